@@ -1,30 +1,76 @@
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import FilterSet, filters
 from recipes.models import Recipe, Tag
+from recipes.search import search_recipes
+
+
+class RecipeOrderingFilter(filters.OrderingFilter):
+    """
+    Сортировка рецептов, дополненная порядком ленты.
+
+    У большинства рецептов счетчики популярности равны нулю; без
+    уникального хвоста сортировки страницы с OFFSET пересекаются.
+    """
+    TIEBREAKERS = ('-pub_date', '-id')
+
+    def filter(self, qs, value):
+        if not value:
+            return qs
+        ordering = [self.get_ordering_value(param) for param in value]
+        fields = {field.lstrip('-') for field in ordering}
+        ordering.extend(
+            field for field in self.TIEBREAKERS
+            if field.lstrip('-') not in fields
+        )
+        return qs.order_by(*ordering)
 
 
 class RecipeFilter(FilterSet):
     """Фильтр рецептов"""
     tags = filters.ModelMultipleChoiceFilter(field_name='tags__slug',
                                              to_field_name='slug',
-                                             queryset=Tag.objects.all())
+                                             queryset=Tag.objects.all(),
+                                             method='get_tags')
     is_favorited = filters.BooleanFilter(
         method='get_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart')
+    search = filters.CharFilter(method='get_search')
+    ordering = RecipeOrderingFilter(
+        fields=('pub_date', 'favorites_count', 'in_carts_count')
+    )
+
+    POPULARITY_FIELDS = ('favorites_count', 'in_carts_count')
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+        fields = (
+            'tags', 'author', 'is_favorited', 'is_in_shopping_cart', 'search'
+        )
+
+    def get_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        # Полусоединение вместо JOIN: рецепт с несколькими из выбранных
+        # тегов не повторяется в выдаче.
+        return queryset.filter(Exists(
+            Recipe.tags.through.objects.filter(
+                recipe=OuterRef('pk'), tag__in=value
+            )
+        ))
 
     def get_is_favorited(self, queryset, name, value):
         user = self.request.user
         if value and user.is_authenticated:
-            return queryset.filter(favorite__user=self.request.user)
+            return queryset.filter(is_favorited=True)
         return queryset
 
     def get_is_in_shopping_cart(self, queryset, name, value):
-        if value:
-            return queryset.filter(
-                shopping_cart__user=self.request.user
-            )
+        user = self.request.user
+        if value and user.is_authenticated:
+            return queryset.filter(is_in_shopping_cart=True)
         return queryset
+
+    def get_search(self, queryset, name, value):
+        # Явный ordering применяется после и заменяет порядок по рангу.
+        return search_recipes(queryset, value)
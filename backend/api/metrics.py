@@ -0,0 +1,67 @@
+import os
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+# Под gunicorn значения пишутся в файлы каталога PROMETHEUS_MULTIPROC_DIR
+# (его задает gunicorn.conf.py), и /metrics собирает их со всех воркеров.
+REQUEST_LATENCY = Histogram(
+    'foodgram_http_request_duration_seconds',
+    'Время обработки запроса',
+    ('route', 'method'),
+    buckets=(
+        0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75,
+        1.0, 2.5, 5.0, 10.0
+    )
+)
+REQUESTS = Counter(
+    'foodgram_http_requests',
+    'Обработанные запросы',
+    ('route', 'method', 'status')
+)
+REQUEST_QUERIES = Histogram(
+    'foodgram_http_request_db_queries',
+    'Число SQL-запросов на запрос',
+    ('route', 'method'),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+)
+IN_FLIGHT = Gauge(
+    'foodgram_http_requests_in_flight',
+    'Запросы в обработке',
+    multiprocess_mode='livesum'
+)
+CACHE_LOOKUPS = Counter(
+    'foodgram_cache_lookups',
+    'Обращения к кешам ответов и фрагментов',
+    ('cache', 'result')
+)
+
+
+def cache_lookup(cache_name, result, count=1):
+    """
+    Учесть обращения к кешу cache_name: result - hit, miss или
+    not_modified, если клиенту хватило его копии.
+    """
+    if count:
+        CACHE_LOOKUPS.labels(cache_name, result).inc(count)
+
+
+def route_name(request):
+    """
+    Имя маршрута для меток: имя URL из resolver_match, а не путь, чтобы
+    число серий не росло с числом рецептов и пользователей.
+    """
+    match = request.resolver_match
+    if match is None or not match.url_name:
+        return 'unmatched'
+    return match.url_name
+
+
+def exposition():
+    """Метрики в текстовом формате и их Content-Type"""
+    registry = REGISTRY
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,224 @@
+import json
+import logging
+import random
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from . import metrics
+from .profiling import RequestProfile, activate
+
+logger = logging.getLogger(__name__)
+
+
+def view_path(request):
+    """Модуль, класс и действие обработавшего запрос представления"""
+    match = request.resolver_match
+    if match is None:
+        return None
+    view = match.func
+    view_class = getattr(view, 'cls', getattr(view, 'view_class', None))
+    if view_class is None:
+        return f'{view.__module__}.{view.__name__}'
+    path = f'{view_class.__module__}.{view_class.__name__}'
+    action = getattr(view, 'actions', {}).get(request.method.lower())
+    return f'{path}.{action}' if action else path
+
+
+@contextmanager
+def wrapped_connections(wrapper):
+    """Выполнять SQL-запросы всех соединений через wrapper"""
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(wrapper))
+        yield
+
+
+class ObservedStream:
+    """
+    Тело потокового ответа, куски которого читаются с wrapper на
+    соединениях: его запросы выполняются уже после выхода из middleware.
+
+    finish вызывается один раз при закрытии ответа, даже если тело так и
+    не читали.
+    """
+
+    _end = object()
+
+    def __init__(self, content, wrapper, finish):
+        self.content = content
+        self.wrapper = wrapper
+        self.finish = finish
+
+    def __iter__(self):
+        iterator = iter(self.content)
+        while True:
+            with wrapped_connections(self.wrapper):
+                chunk = next(iterator, self._end)
+            if chunk is self._end:
+                return
+            yield chunk
+
+    def close(self):
+        finish, self.finish = self.finish, None
+        if finish is not None:
+            finish()
+
+
+class RequestProfilingMiddleware:
+    """
+    Число и время SQL-запросов, время представления, сериализации и
+    рендеринга каждого запроса.
+
+    Включается настройкой REQUEST_PROFILING; без нее Django исключает
+    middleware из цепочки. Доля профилируемых запросов задается
+    REQUEST_PROFILING_SAMPLE_RATE. Итоги отдаются в заголовке
+    Server-Timing и пишутся строкой JSON в лог, а для запросов дольше
+    REQUEST_PROFILING_SLOW_MS в лог попадают самые медленные и
+    повторяющиеся SQL-запросы. Потоковый ответ учитывается при закрытии,
+    вместе с запросами его тела; заголовки к этому времени уже отправлены,
+    поэтому Server-Timing у него нет.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.REQUEST_PROFILING_SAMPLE_RATE:
+            return self.get_response(request)
+        profile = RequestProfile()
+        request.profile = profile
+        with activate(profile), wrapped_connections(profile.execute):
+            response = self.get_response(request)
+
+        def finish():
+            total = time.perf_counter() - profile.started
+            view_finished = getattr(request, 'view_finished', None)
+            if view_finished is not None:
+                profile.add('render', time.perf_counter() - view_finished)
+            self.report(request, response, profile, total)
+
+        if response.streaming:
+            response.streaming_content = ObservedStream(
+                response.streaming_content, profile.execute, finish
+            )
+        else:
+            finish()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if hasattr(request, 'profile'):
+            request.view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # Ответы DRF рендерятся после выхода из представления.
+        if hasattr(request, 'view_started'):
+            request.view_finished = time.perf_counter()
+            request.profile.add(
+                'view', request.view_finished - request.view_started
+            )
+        return response
+
+    def report(self, request, response, profile, total):
+        timings = {
+            'db': profile.db_time,
+            **profile.timings,
+            'total': total,
+        }
+        if not response.streaming:
+            response['Server-Timing'] = ', '.join(
+                f'{name};dur={duration * 1000:.1f}'
+                + (
+                    f';desc="{profile.queries} queries"'
+                    if name == 'db' else ''
+                )
+                for name, duration in timings.items()
+            )
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': view_path(request),
+            'status': response.status_code,
+            'queries': profile.queries,
+            **{
+                f'{name}_ms': round(duration * 1000, 1)
+                for name, duration in timings.items()
+            },
+        }
+        logger.info(json.dumps(record, ensure_ascii=False))
+        if total * 1000 < settings.REQUEST_PROFILING_SLOW_MS:
+            return
+        slowest = sorted(
+            profile.statements, key=lambda item: item[1], reverse=True
+        )[:5]
+        repeated = Counter(sql for sql, _ in profile.statements)
+        logger.warning(json.dumps({
+            **record,
+            'slowest_sql': [
+                {'sql': sql, 'ms': round(duration * 1000, 1)}
+                for sql, duration in slowest
+            ],
+            'duplicated_sql': [
+                {'sql': sql, 'count': count}
+                for sql, count in repeated.most_common(5) if count > 1
+            ],
+        }, ensure_ascii=False))
+
+
+class MetricsMiddleware:
+    """
+    Метрики Prometheus по маршрутам: время ответа, число запросов и
+    SQL-запросов, запросы в обработке. Включается METRICS_ENABLED.
+
+    Потоковый ответ учитывается при закрытии: время и SQL-запросы
+    включают чтение его тела.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        metrics.IN_FLIGHT.inc()
+        try:
+            with wrapped_connections(count):
+                response = self.get_response(request)
+        except BaseException:
+            metrics.IN_FLIGHT.dec()
+            raise
+
+        def finish():
+            metrics.IN_FLIGHT.dec()
+            route = metrics.route_name(request)
+            metrics.REQUEST_LATENCY.labels(route, request.method).observe(
+                time.perf_counter() - started
+            )
+            metrics.REQUEST_QUERIES.labels(route, request.method).observe(
+                queries
+            )
+            metrics.REQUESTS.labels(
+                route, request.method, response.status_code
+            ).inc()
+
+        if response.streaming:
+            response.streaming_content = ObservedStream(
+                response.streaming_content, count, finish
+            )
+        else:
+            finish()
+        return response
@@ -1,8 +1,28 @@
-from rest_framework import mixins
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import (get_conditional_response,
+                                patch_cache_control, patch_vary_headers)
+from django.utils.http import http_date, parse_etags, quote_etag
+from rest_framework import mixins, status
 from rest_framework import viewsets
+from rest_framework.response import Response
+
+from recipes.cache import get_version
+from .metrics import cache_lookup
+from .profiling import timed_serializer
+
+
+class SerializerTimingMixin:
+    """Учет времени сериализации в профиле запроса"""
+
+    def get_serializer(self, *args, **kwargs):
+        return timed_serializer(super().get_serializer(*args, **kwargs))
 
 
 class ListViewSet(
+    SerializerTimingMixin,
     mixins.ListModelMixin,
     viewsets.GenericViewSet
 ):
@@ -10,8 +30,112 @@ class ListViewSet(
 
 
 class ListRetrieveViewSet(
+    SerializerTimingMixin,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
     viewsets.GenericViewSet
 ):
     pass
+
+
+class VersionedCacheMixin:
+    """
+    Кеширование ответов list и retrieve по версии набора данных.
+
+    cache_version_name - имя набора из recipes.cache; его версию поднимают
+    сигналы при изменении данных, после чего старые ключи не используются.
+    Ответ получает ETag, и по If-None-Match клиент получает 304.
+    """
+    cache_version_name = None
+
+    def list(self, request, *args, **kwargs):
+        return self._cached(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._cached(super().retrieve, request, *args, **kwargs)
+
+    def _cached(self, handler, request, *args, **kwargs):
+        version = get_version(self.cache_version_name)
+        digest = hashlib.md5(
+            request.get_full_path().encode()
+        ).hexdigest()
+        etag = quote_etag(f'{self.cache_version_name}-{version}-{digest}')
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            cache_lookup('reference', 'not_modified')
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            key = f'{self.cache_version_name}:{version}:{digest}'
+            data = cache.get(key)
+            cache_lookup('reference', 'miss' if data is None else 'hit')
+            if data is None:
+                response = handler(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(key, response.data, settings.REFERENCE_CACHE_TTL)
+            else:
+                response = Response(data)
+        response['ETag'] = etag
+        patch_cache_control(response, no_cache=True)
+        return response
+
+
+class ConditionalGetMixin:
+    """
+    Условные GET-запросы для list и retrieve.
+
+    get_validators возвращает пару (etag, last_modified) без сериализации
+    данных; если клиент уже получил эту версию, отдается 304.
+    """
+
+    def get_validators(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    def list(self, request, *args, **kwargs):
+        return self._conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._conditional(super().retrieve, request, *args, **kwargs)
+
+    def _conditional(self, handler, request, *args, **kwargs):
+        validators = self.get_validators(request, *args, **kwargs)
+        if validators is None:
+            return handler(request, *args, **kwargs)
+        etag, last_modified = validators
+        etag = quote_etag(etag)
+        last_modified = int(last_modified.timestamp())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        else:
+            cache_lookup('conditional', 'not_modified')
+        if response.status_code in (
+            status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED
+        ):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ('Authorization',))
+        return response
+
+
+class CursorPaginationMixin:
+    """
+    Курсорная пагинация списка по запросу ?pagination=cursor.
+
+    Ответ содержит только next, previous и results, поэтому клиенты
+    переходят на него явно, а постраничный режим остается по умолчанию.
+    """
+    cursor_pagination_class = None
+
+    @property
+    def paginator(self):
+        if (
+            not hasattr(self, '_paginator')
+            and self.cursor_pagination_class is not None
+            and self.action == 'list'
+            and self.request.query_params.get('pagination') == 'cursor'
+        ):
+            self._paginator = self.cursor_pagination_class()
+        return super().paginator
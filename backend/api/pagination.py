@@ -1,5 +1,134 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (Cursor, CursorPagination,
+                                       PageNumberPagination)
 
 
 class CustomPaginator(PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Курсорная пагинация по всем полям ordering.
+
+    CursorPagination DRF фильтрует только по первому полю ordering, а
+    записи с одинаковым значением пропускает смещением. Здесь позиция
+    хранит значения всех полей, последнее из которых уникально, и
+    страница выбирается условием (a, b) < (x, y) без OFFSET.
+    """
+    page_size_query_param = 'limit'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = None if self.cursor is None else self.cursor.position
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(
+                field[1:] if field.startswith('-') else f'-{field}'
+                for field in ordering
+            )
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(
+                ordering, self.load_position(queryset.model, position)
+            ))
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_following = len(results) > len(self.page)
+        if reverse:
+            self.page.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_following
+        else:
+            self.has_next = has_following
+            self.has_previous = position is not None
+        self.current_position = position
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def after(self, ordering, values):
+        """Условие «строка идет после позиции values в порядке ordering»"""
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        first = ordering[0]
+        # Граница по первому полю позволяет читать индекс диапазоном.
+        bound = 'lte' if first.startswith('-') else 'gte'
+        return Q(**{f'{first.lstrip("-")}__{bound}': values[0]}) & condition
+
+    def load_position(self, model, position):
+        """Значения полей ordering из курсора, приведенные к типам полей"""
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            values = [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (ValidationError, TypeError):
+            raise NotFound(self.invalid_cursor_message)
+        if None in values:
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def _get_position_from_instance(self, instance, ordering):
+        return json.dumps([
+            str(
+                instance[field.lstrip('-')] if isinstance(instance, dict)
+                else getattr(instance, field.lstrip('-'))
+            )
+            for field in ordering
+        ])
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = self.current_position
+        if self.page:
+            position = self._get_position_from_instance(
+                self.page[-1], self.ordering
+            )
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=False, position=position)
+        )
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = self.current_position
+        if self.page:
+            position = self._get_position_from_instance(
+                self.page[0], self.ordering
+            )
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=True, position=position)
+        )
+
+
+class RecipeCursorPaginator(KeysetCursorPagination):
+    """Курсорная пагинация ленты рецептов без COUNT и OFFSET"""
+    ordering = ('-pub_date', '-id')
+
+
+class SubscriptionsCursorPaginator(KeysetCursorPagination):
+    """Курсорная пагинация подписок"""
+    ordering = ('username', 'id')
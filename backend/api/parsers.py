@@ -0,0 +1,26 @@
+import json
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import MultiPartParser
+
+
+class MultiPartJSONParser(MultiPartParser):
+    """
+    multipart/form-data, в котором поля объекта переданы JSON-ом.
+
+    Поля передаются в части data так же, как в теле JSON-запроса,
+    а файлы - отдельными частями с именами полей.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parsed = super().parse(stream, media_type, parser_context)
+        if 'data' not in parsed.data:
+            return parsed
+        try:
+            data = json.loads(parsed.data['data'])
+        except ValueError as exc:
+            raise ParseError(f'Часть data содержит неверный JSON - {exc}')
+        if not isinstance(data, dict):
+            raise ParseError('Часть data должна содержать JSON-объект.')
+        data.update(parsed.files.dict())
+        return data
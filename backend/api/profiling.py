@@ -0,0 +1,87 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+_current = contextvars.ContextVar('request_profile', default=None)
+
+
+class RequestProfile:
+    """Счетчики SQL и времени одного запроса"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = []
+        self.timings = {}
+
+    def execute(self, execute, sql, params, many, context):
+        """Обертка для connection.execute_wrapper"""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.queries += 1
+            self.db_time += duration
+            self.statements.append((sql, duration))
+
+    def add(self, name, duration):
+        self.timings[name] = self.timings.get(name, 0.0) + duration
+
+
+def current_profile():
+    """Профиль текущего запроса или None, если запрос не профилируется"""
+    return _current.get()
+
+
+@contextmanager
+def activate(profile):
+    token = _current.set(profile)
+    try:
+        yield profile
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed(name):
+    """Добавить время выполнения блока к счетчику name профиля"""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - started)
+
+
+def _timed_data(self):
+    with timed('serializer'):
+        return super(type(self), self).data
+
+
+@lru_cache(maxsize=None)
+def _timed_class(serializer_class):
+    return type(serializer_class)(
+        serializer_class.__name__,
+        (serializer_class,),
+        {
+            '__module__': serializer_class.__module__,
+            'data': property(_timed_data),
+        }
+    )
+
+
+def timed_serializer(serializer):
+    """
+    Учитывать сериализацию serializer.data в профиле запроса.
+
+    Вне профилируемого запроса сериализатор возвращается как есть.
+    """
+    if _current.get() is not None:
+        serializer.__class__ = _timed_class(type(serializer))
+    return serializer
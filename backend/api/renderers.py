@@ -0,0 +1,72 @@
+import csv
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+class Echo:
+    """Объект-файл, который возвращает записанную строку"""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingCartRenderer(BaseRenderer):
+    """
+    Базовый рендерер списка покупок.
+
+    stream получает итератор строк (название, количество, единицы)
+    и отдает файл по частям, не собирая его целиком в памяти.
+    """
+    charset = 'utf-8'
+
+    def stream(self, rows):
+        raise NotImplementedError
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            # Ошибки отдаются текстом сообщения.
+            return '\n'.join(
+                str(value) for value in data.values()
+            ).encode(self.charset)
+        return ''.join(self.stream(data)).encode(self.charset)
+
+
+class ShoppingCartTxtRenderer(ShoppingCartRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, rows):
+        yield 'Список покупок:\n'
+        for name, amount, units in rows:
+            yield f'{name} - {amount} {units}.\n'
+
+
+class ShoppingCartCsvRenderer(ShoppingCartRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, rows):
+        writer = csv.writer(Echo())
+        # BOM нужен, чтобы Excel открыл кириллицу в UTF-8.
+        yield '\ufeff' + writer.writerow(
+            ('Ингредиент', 'Количество', 'Единицы измерения')
+        )
+        for row in rows:
+            yield writer.writerow(row)
+
+
+class ShoppingCartJsonRenderer(ShoppingCartRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def stream(self, rows):
+        yield '['
+        separator = ''
+        for name, amount, units in rows:
+            yield separator + json.dumps(
+                {'name': name, 'amount': amount, 'units': units},
+                ensure_ascii=False
+            )
+            separator = ','
+        yield ']'
@@ -1,10 +1,44 @@
+import hashlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from django.db.models import prefetch_related_objects
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from drf_base64.fields import Base64ImageField
 from rest_framework import serializers
 
+from recipes import shopping_cart
+from recipes.cache import (INGREDIENTS, TAGS, get_versions,
+                           recipe_version_name, user_version_name)
 from recipes.models import (Tag, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Favorite)
+                            ShoppingCart, Favorite, recipe_prefetch_lookups)
 from users.models import User, Subscribe
+from .metrics import cache_lookup
+
+
+def subscribed_author_ids(request):
+    """
+    id авторов, на которых подписан текущий пользователь.
+
+    Загружаются одним запросом и кешируются на объекте запроса.
+    """
+    if request is None or not request.user.is_authenticated:
+        return frozenset()
+    if not hasattr(request, 'subscribed_author_ids'):
+        request.subscribed_author_ids = set(
+            request.user.subscriber.values_list('author_id', flat=True)
+        )
+    return request.subscribed_author_ids
+
+
+def is_subscribed(request, author):
+    """Подписан ли текущий пользователь на автора"""
+    if hasattr(author, 'is_subscribed'):
+        return author.is_subscribed
+    return author.pk in subscribed_author_ids(request)
 
 
 class UserListSerializer(UserSerializer):
@@ -23,12 +57,7 @@ class UserListSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, value):
-        request = self.context.get('request')
-
-        return (
-                request.user.is_authenticated
-                and request.user.subscriber.filter(author=value).exists()
-        )
+        return is_subscribed(self.context.get('request'), value)
 
 
 class SignUpSerializer(UserCreateSerializer):
@@ -55,8 +84,35 @@ class SignUpSerializer(UserCreateSerializer):
         return value
 
 
+class RecipeImageField(serializers.ImageField):
+    """
+    Ссылка на картинку рецепта в нужном варианте.
+
+    Вариант задается аргументом variant или ключом image_variant
+    контекста; пока вариант не готов, отдается исходная картинка.
+    """
+
+    def __init__(self, variant=None, **kwargs):
+        self.variant = variant
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        variant = self.variant or self.context.get('image_variant')
+        name = recipe.image_variants.get(variant) if variant else None
+        if name is None:
+            return super().to_representation(recipe.image)
+        url = default_storage.url(name)
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
 class RecipeShortSerializer(serializers.ModelSerializer):
     """Сериализатор для работы с краткой информацией о рецепте"""
+    image = RecipeImageField(variant='thumbnail')
 
     class Meta:
         model = Recipe
@@ -65,7 +121,7 @@ class RecipeShortSerializer(serializers.ModelSerializer):
 
 class RecipeSerializer(serializers.ModelSerializer):
     """Сериализатор рецептов"""
-    image = Base64ImageField(read_only=True)
+    image = RecipeImageField(variant='thumbnail')
     name = serializers.CharField(read_only=True)
     cooking_time = serializers.IntegerField(read_only=True)
 
@@ -74,11 +130,22 @@ class RecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'image', 'cooking_time')
 
 
+def get_recipes_limit(request):
+    """Значение параметра recipes_limit или None, если он не передан"""
+    limit = request.query_params.get('recipes_limit')
+    if not limit:
+        return None
+    if not limit.isdigit():
+        raise serializers.ValidationError(
+            {'recipes_limit': 'Нужно указать целое неотрицательное число.'}
+        )
+    return int(limit)
+
+
 class SubscriptionsSerializer(serializers.ModelSerializer):
     """Сериализатор информации о подписках пользователя"""
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
 
     class Meta:
         model = User
@@ -104,22 +171,14 @@ class SubscriptionsSerializer(serializers.ModelSerializer):
         )
 
     def get_is_subscribed(self, value):
-        request = self.context.get('request')
-
-        return (
-                request.user.is_authenticated
-                and request.user.subscriber.filter(author=value).exists()
-        )
-
-    def get_recipes_count(self, value):
-        return value.recipes.count()
+        return is_subscribed(self.context.get('request'), value)
 
     def get_recipes(self, value):
         request = self.context.get('request')
-        limit = request.query_params.get('recipes_limit')
-        recipes = value.recipes.all()
-        if limit:
-            recipes = recipes[:int(limit)]
+        if hasattr(value, 'limited_recipes'):
+            recipes = value.limited_recipes
+        else:
+            recipes = value.recipes.all()[:get_recipes_limit(request)]
         serializers = RecipeShortSerializer(
             recipes,
             many=True,
@@ -151,12 +210,7 @@ class SubscribeSerializer(serializers.ModelSerializer):
         return value
 
     def get_is_subscribed(self, value):
-        request = self.context.get('request')
-
-        return (
-                request.user.is_authenticated
-                and request.user.subscriber.filter(author=value).exists()
-        )
+        return is_subscribed(self.context.get('request'), value)
 
     def to_representation(self, instance):
         request = self.context.get('request')
@@ -193,15 +247,80 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'units', 'amount')
 
 
+def recipe_fragment_keys(recipes, request, image_variant=None):
+    """
+    Ключи кеша общей для всех пользователей части рецептов.
+
+    Ключ меняется вместе с версиями рецепта, его автора, тегов и
+    справочника ингредиентов (названия и единицы измерения), а также
+    с адресом сайта и вариантом картинки, от которых зависят ссылки.
+    """
+    recipe_names = {
+        recipe.pk: recipe_version_name(recipe.pk) for recipe in recipes
+    }
+    author_names = {
+        recipe.pk: user_version_name(recipe.author_id) for recipe in recipes
+    }
+    versions = get_versions(
+        {TAGS, INGREDIENTS, *recipe_names.values(), *author_names.values()}
+    )
+    host = request.build_absolute_uri('/') if request is not None else ''
+    return {
+        recipe.pk: 'recipe_fragment:' + hashlib.md5(
+            f'{recipe.pk}:{versions[recipe_names[recipe.pk]]}:'
+            f'{versions[author_names[recipe.pk]]}:{versions[TAGS]}:'
+            f'{versions[INGREDIENTS]}:{host}:{image_variant}'.encode()
+        ).hexdigest()
+        for recipe in recipes
+    }
+
+
+class RecipeFragmentListSerializer(serializers.ListSerializer):
+    """
+    Сборка списка рецептов из кеша.
+
+    Связанные данные подгружаются только для рецептов, которых нет в кеше.
+    """
+
+    def to_representation(self, data):
+        if isinstance(data, models.Manager):
+            data = data.all()
+        recipes = list(data)
+        request = self.context.get('request')
+        keys = recipe_fragment_keys(
+            recipes, request, self.context.get('image_variant')
+        )
+        fragments = cache.get_many(list(keys.values()))
+        missing = [
+            recipe for recipe in recipes if keys[recipe.pk] not in fragments
+        ]
+        cache_lookup('recipe_fragment', 'hit', len(recipes) - len(missing))
+        cache_lookup('recipe_fragment', 'miss', len(missing))
+        if missing:
+            prefetch_related_objects(
+                missing, 'author', *recipe_prefetch_lookups()
+            )
+            built = {
+                keys[recipe.pk]: self.child.to_fragment(recipe)
+                for recipe in missing
+            }
+            cache.set_many(built, settings.RECIPE_FRAGMENT_CACHE_TTL)
+            fragments.update(built)
+        return [
+            self.child.overlay(recipe, fragments[keys[recipe.pk]])
+            for recipe in recipes
+        ]
+
+
 class RecipeListSerializer(serializers.ModelSerializer):
     """Сериализатор получения рецептов"""
-    author = UserSerializer(read_only=True)
+    author = UserListSerializer(read_only=True)
     tags = TagSerializer(many=True, read_only=True)
     ingredients = RecipeIngredientSerializer(
-        many=True, read_only=True, source='recipes')
+        many=True, read_only=True, source='ingredient_amount')
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
-    image = Base64ImageField()
+    image = RecipeImageField()
 
     class Meta:
         model = Recipe
@@ -217,8 +336,42 @@ class RecipeListSerializer(serializers.ModelSerializer):
             'is_favorited',
             'is_in_shopping_cart'
         )
+        list_serializer_class = RecipeFragmentListSerializer
+
+    def to_fragment(self, instance):
+        """Представление рецепта без полей, зависящих от пользователя"""
+        return super().to_representation(instance)
+
+    def overlay(self, instance, fragment):
+        """Дополнение закешированного представления данными пользователя"""
+        data = OrderedDict(fragment)
+        data['author'] = OrderedDict(
+            fragment['author'],
+            is_subscribed=(
+                instance.author_id
+                in subscribed_author_ids(self.context.get('request'))
+            )
+        )
+        data['is_favorited'] = self.get_is_favorited(instance)
+        data['is_in_shopping_cart'] = self.get_is_in_shopping_cart(instance)
+        return data
+
+    def to_representation(self, instance):
+        key = recipe_fragment_keys(
+            [instance],
+            self.context.get('request'),
+            self.context.get('image_variant')
+        )[instance.pk]
+        fragment = cache.get(key)
+        cache_lookup('recipe_fragment', 'miss' if fragment is None else 'hit')
+        if fragment is None:
+            fragment = self.to_fragment(instance)
+            cache.set(key, fragment, settings.RECIPE_FRAGMENT_CACHE_TTL)
+        return self.overlay(instance, fragment)
 
     def get_is_favorited(self, value):
+        if hasattr(value, 'is_favorited'):
+            return value.is_favorited
         request = self.context.get('request')
 
         return (
@@ -227,6 +380,8 @@ class RecipeListSerializer(serializers.ModelSerializer):
         )
 
     def get_is_in_shopping_cart(self, value):
+        if hasattr(value, 'is_in_shopping_cart'):
+            return value.is_in_shopping_cart
         request = self.context.get('request')
 
         return (
@@ -235,6 +390,33 @@ class RecipeListSerializer(serializers.ModelSerializer):
         )
 
 
+class RecipeMatchSerializer(RecipeListSerializer):
+    """
+    Рецепт, подобранный по ингредиентам пользователя.
+
+    Число совпавших ингредиентов берется из атрибута match рецепта.
+    """
+
+    def overlay(self, instance, fragment):
+        data = super().overlay(instance, fragment)
+        data['matched_ingredients'] = instance.match.matched
+        data['coverage'] = round(instance.match.coverage, 3)
+        return data
+
+
+class RecipeMatchParamsSerializer(serializers.Serializer):
+    """Параметры подбора рецептов по имеющимся ингредиентам"""
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False
+    )
+    min_coverage = serializers.FloatField(
+        min_value=0,
+        max_value=1,
+        default=settings.RECIPE_MATCH_MIN_COVERAGE
+    )
+
+
 class RecipeIngredientCreateSerializer(serializers.ModelSerializer):
     """Сериализатор создания рецептов-ингредиентов"""
     id = serializers.IntegerField()
@@ -265,15 +447,18 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         )
 
     def validate(self, value):
+        # При частичном обновлении проверяются только переданные поля.
         for field in ['name', 'text', 'cooking_time']:
-            if not value.get(field):
+            if (not self.partial or field in value) and not value.get(field):
                 raise serializers.ValidationError(
                     f'{field} - Обязательное поле.'
                 )
-        if not value.get('tags'):
+        if (not self.partial or 'tags' in value) and not value.get('tags'):
             raise serializers.ValidationError(
                 'Нужно указать тег.'
             )
+        if 'ingredients' not in value and self.partial:
+            return value
         if not value.get('ingredients'):
             raise serializers.ValidationError(
                 'Нужно указать ингредиент.'
@@ -284,6 +469,15 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 'Ингредиенты должны быть уникальны.'
             )
+        ingredients = Ingredient.objects.in_bulk(unique_ingredient_id_list)
+        missing = sorted(unique_ingredient_id_list - ingredients.keys())
+        if missing:
+            raise serializers.ValidationError(
+                'Ингредиенты не найдены: '
+                + ', '.join(str(pk) for pk in missing) + '.'
+            )
+        for item in value['ingredients']:
+            item['ingredient'] = ingredients[item['id']]
 
         return value
 
@@ -293,7 +487,7 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         RecipeIngredient.objects.bulk_create(
             [RecipeIngredient(
                 recipe=recipe,
-                ingredient=Ingredient.objects.get(pk=ingredient['id']),
+                ingredient=ingredient['ingredient'],
                 amount=ingredient['amount']
             ) for ingredient in ingredients]
         )
@@ -309,21 +503,67 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
 
         return recipe
 
+    @staticmethod
+    def _update_ingredients(recipe, ingredients):
+        """
+        Привести строки состава к ingredients, меняя только отличия.
+
+        Возвращает старый и новый состав: {ingredient_id: amount}.
+        """
+        current = {
+            line.ingredient_id: line
+            for line in RecipeIngredient.objects.filter(recipe=recipe)
+        }
+        old_amounts = {pk: line.amount for pk, line in current.items()}
+        new_amounts = {
+            item['ingredient'].pk: item['amount'] for item in ingredients
+        }
+        removed = old_amounts.keys() - new_amounts.keys()
+        if removed:
+            RecipeIngredient.objects.filter(
+                recipe=recipe, ingredient_id__in=removed
+            ).delete()
+        changed = []
+        for pk, amount in new_amounts.items():
+            line = current.get(pk)
+            if line is not None and line.amount != amount:
+                line.amount = amount
+                changed.append(line)
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        added = [
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient=item['ingredient'],
+                amount=item['amount']
+            ) for item in ingredients if item['ingredient'].pk not in current
+        ]
+        if added:
+            RecipeIngredient.objects.bulk_create(added)
+
+        return old_amounts, new_amounts
+
+    @transaction.atomic
     def update(self, instance, validated_data):
-        tags = validated_data.pop('tags')
-        ingredients = validated_data.pop('ingredients')
-        instance.tags.clear()
-        instance.tags.set(tags)
-        RecipeIngredient.objects.filter(
-            recipe=instance,
-            ingredient__in=instance.ingredients.all()).delete()
+        tags = validated_data.pop('tags', None)
+        ingredients = validated_data.pop('ingredients', None)
+        # Параллельные изменения одного рецепта выполняются по очереди,
+        # иначе разницы состава считались бы от устаревшего состояния.
+        Recipe.objects.select_for_update().filter(pk=instance.pk).exists()
         super().update(instance, validated_data)
-        self._create_set(instance, tags, ingredients)
-        instance.save()
+        if tags is not None:
+            instance.tags.set(tags)
+        if ingredients is not None:
+            shopping_cart.change_recipe(
+                instance.pk,
+                *self._update_ingredients(instance, ingredients)
+            )
 
         return instance
 
     def to_representation(self, instance):
+        request = self.context.get('request')
+        instance = Recipe.objects.for_read(request.user).get(pk=instance.pk)
         return RecipeListSerializer(instance, context=self.context).data
 
 
@@ -0,0 +1,490 @@
+import base64
+import io
+import json
+import shutil
+import tempfile
+import time
+from unittest import mock
+from urllib.parse import quote, urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from prometheus_client import REGISTRY
+from rest_framework.test import APIClient
+
+from recipes import shopping_cart
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, ShoppingCartIngredient, Tag)
+from users.models import Subscribe, User
+from .uploadhandlers import has_image_signature
+
+
+class RecipeDataMixin:
+    """Авторы с рецептами, избранное, корзина и подписки зрителя"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user(
+            username='viewer', email='viewer@example.com', password='p',
+            first_name='Зритель', last_name='Тестовый'
+        )
+        cls.authors = [
+            User.objects.create_user(
+                username=f'author{number}',
+                email=f'author{number}@example.com', password='p',
+                first_name='Автор', last_name=str(number)
+            )
+            for number in range(3)
+        ]
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {number}', color='#aaaaaa',
+                               slug=f'tag{number}')
+            for number in range(2)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=name, units='г')
+            for name in ('мука', 'молоко', 'соль', 'сахар')
+        ]
+        cls.recipes = []
+        for number in range(9):
+            recipe = Recipe.objects.create(
+                author=cls.authors[number % 3], name=f'Рецепт {number}',
+                text='Смешать.', cooking_time=10
+            )
+            recipe.tags.set(cls.tags[:number % 2 + 1])
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=10 * (index + 1))
+                for index, ingredient in enumerate(cls.ingredients)
+            )
+            cls.recipes.append(recipe)
+        for recipe in cls.recipes[:4]:
+            Favorite.objects.create(user=cls.viewer, recipe=recipe)
+            ShoppingCart.objects.create(user=cls.viewer, recipe=recipe)
+        for author in cls.authors:
+            Subscribe.objects.create(user=cls.viewer, author=author)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+
+class QueryCountTests(RecipeDataMixin, TestCase):
+    """Число SQL-запросов не зависит от числа рецептов на странице"""
+
+    def assertQueries(self, count, path):
+        with self.assertNumQueries(count):
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_recipe_list(self):
+        response = self.assertQueries(7, '/api/recipes/')
+        self.assertEqual(len(response.data['results']), 6)
+
+    def test_recipe_list_filtered_by_tag(self):
+        # Слаги тегов проверяются одним запросом на валидаторы и список.
+        tag = self.tags[0]
+        response = self.assertQueries(8, f'/api/recipes/?tags={tag.slug}')
+        self.assertEqual(
+            response.data['count'],
+            Recipe.objects.filter(tags=tag).distinct().count()
+        )
+
+    def test_recipe_list_cached_fragments(self):
+        self.client.get('/api/recipes/')
+        self.assertQueries(4, '/api/recipes/')
+
+    def test_recipe_detail(self):
+        self.assertQueries(5, f'/api/recipes/{self.recipes[0].pk}/')
+
+    def test_subscriptions(self):
+        response = self.assertQueries(
+            3, '/api/users/subscriptions/?recipes_limit=2'
+        )
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_download_shopping_cart(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/recipes/download_shopping_cart/')
+            content = b''.join(response.streaming_content).decode()
+        self.assertIn('мука - 40 г.', content)
+
+    def test_download_shopping_cart_metrics(self):
+        # Запрос списка выполняется при чтении тела, после middleware.
+        labels = {'route': 'recipes-download-shopping-cart', 'method': 'GET'}
+
+        def observed():
+            return REGISTRY.get_sample_value(
+                'foodgram_http_request_db_queries_sum', labels
+            ) or 0
+
+        before = observed()
+        response = self.client.get('/api/recipes/download_shopping_cart/')
+        self.assertEqual(observed(), before)
+        b''.join(response.streaming_content)
+        self.assertEqual(observed(), before + 1)
+
+    def test_download_shopping_cart_csv(self):
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/?format=csv'
+        )
+        content = b''.join(response.streaming_content).decode()
+        self.assertTrue(content.startswith('\ufeffИнгредиент,'))
+        self.assertIn('мука,40,г', content)
+
+
+class CursorPaginationTests(RecipeDataMixin, TestCase):
+    """Курсорная пагинация по (pub_date, id)"""
+
+    def walk(self, url, link):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([recipe['id'] for recipe in response.data['results']])
+            url = response.data[link]
+        return pages
+
+    def test_equal_pub_dates(self):
+        Recipe.objects.update(pub_date=self.recipes[0].pub_date)
+        expected = sorted((recipe.pk for recipe in self.recipes), reverse=True)
+        pages = self.walk('/api/recipes/?pagination=cursor&limit=4', 'next')
+        self.assertEqual([len(page) for page in pages], [4, 4, 1])
+        self.assertEqual(sum(pages, []), expected)
+        last = self.client.get(
+            '/api/recipes/?pagination=cursor&limit=4'
+        ).data['next']
+        last = self.client.get(last).data['next']
+        backwards = self.walk(
+            self.client.get(last).data['previous'], 'previous'
+        )
+        self.assertEqual(backwards, [expected[4:8], expected[:4]])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/recipes/?pagination=cursor&cursor=x')
+        self.assertEqual(response.status_code, 404)
+
+    def test_tampered_cursor_values(self):
+        for position in (['x', 'y'], [None, 1], [[1], {}], ['x']):
+            cursor = base64.b64encode(
+                urlencode({'p': json.dumps(position)}).encode()
+            ).decode()
+            with self.subTest(position=position):
+                response = self.client.get(
+                    '/api/recipes/?pagination=cursor&cursor='
+                    f'{quote(cursor)}'
+                )
+                self.assertEqual(response.status_code, 404)
+
+
+class RecipeOrderingTests(RecipeDataMixin, TestCase):
+    """Страницы сортировки по популярности не пересекаются"""
+
+    def test_popularity_ordering_pages(self):
+        Recipe.objects.update(pub_date=self.recipes[0].pub_date)
+        seen = []
+        for page in (1, 2, 3):
+            response = self.client.get(
+                f'/api/recipes/?ordering=-favorites_count&limit=4&page={page}'
+            )
+            self.assertEqual(response.status_code, 200)
+            seen.extend(recipe['id'] for recipe in response.data['results'])
+        favorites = {recipe.pk for recipe in self.recipes[:4]}
+        others = sorted(
+            (recipe.pk for recipe in self.recipes[4:]), reverse=True
+        )
+        self.assertEqual(set(seen[:4]), favorites)
+        self.assertEqual(seen[4:], others)
+
+
+class RecipeSearchTests(TestCase):
+    """Полнотекстовый поиск рецептов по ?search="""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='p',
+            first_name='Автор', last_name='Тестовый'
+        )
+        cls.by_name = cls.create('Пирог с капустой', 'Испечь в духовке.')
+        cls.by_text = cls.create('Ужин', 'Подать вместо пирога с чаем.')
+        cls.with_yo = cls.create('Ёжики в томате', 'Тушить полчаса.')
+
+    @classmethod
+    def create(cls, name, text):
+        return Recipe.objects.create(
+            author=cls.author, name=name, text=text, cooking_time=10
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def found(self, query):
+        response = self.client.get('/api/recipes/', {'search': query})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_name_ranked_above_text(self):
+        # Рецепт с совпадением в описании новее и в ленте шел бы первым.
+        self.assertEqual(
+            self.found('пирог'), [self.by_name.pk, self.by_text.pk]
+        )
+
+    def test_yo_folding(self):
+        for query in ('ежики', 'Ёжики', 'ЁЖИК'):
+            with self.subTest(query=query):
+                self.assertEqual(self.found(query), [self.with_yo.pk])
+
+    def test_index_follows_rename_and_delete(self):
+        self.by_name.name = 'Кекс'
+        self.by_name.save()
+        self.assertEqual(self.found('пирог'), [self.by_text.pk])
+        self.assertEqual(self.found('кекс'), [self.by_name.pk])
+        self.by_text.delete()
+        self.assertEqual(self.found('пирог'), [])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class RecipeCreateTests(RecipeDataMixin, TestCase):
+    """Ингредиенты нового рецепта проверяются одним запросом"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.extra_ingredients = [
+            Ingredient.objects.create(name=f'специя {number}', units='г')
+            for number in range(20)
+        ]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def payload(self, ingredient_ids):
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8)).save(buffer, 'PNG')
+        return {
+            'name': 'Новый рецепт',
+            'text': 'Смешать.',
+            'cooking_time': 5,
+            'tags': [self.tags[0].pk],
+            'image': 'data:image/png;base64,'
+            + base64.b64encode(buffer.getvalue()).decode(),
+            'ingredients': [
+                {'id': pk, 'amount': 10} for pk in ingredient_ids
+            ],
+        }
+
+    def create(self, ingredient_ids):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                '/api/recipes/', self.payload(ingredient_ids), format='json'
+            )
+        self.assertEqual(response.status_code, 201, response.data)
+        return len(queries)
+
+    def test_unknown_ingredients_are_listed(self):
+        known = self.ingredients[0].pk
+        response = self.client.post(
+            '/api/recipes/', self.payload([known, 999998, 999999]),
+            format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(
+            'Ингредиенты не найдены: 999998, 999999.',
+            response.data['non_field_errors']
+        )
+
+    def test_query_count_does_not_depend_on_ingredients(self):
+        small = self.create([self.ingredients[0].pk])
+        large = self.create(
+            [ingredient.pk for ingredient in self.extra_ingredients]
+        )
+        self.assertEqual(small, large)
+
+
+class RecipeUpdateTests(RecipeDataMixin, TestCase):
+    """PATCH рецепта меняет только переданные поля и строки состава"""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.recipes[0]
+        self.client.force_authenticate(self.recipe.author)
+        self.path = f'/api/recipes/{self.recipe.pk}/'
+
+    def lines(self):
+        return {
+            line.ingredient_id: (line.pk, line.amount)
+            for line in RecipeIngredient.objects.filter(recipe=self.recipe)
+        }
+
+    def test_patch_without_tags_and_ingredients(self):
+        tags = set(self.recipe.tags.values_list('pk', flat=True))
+        lines = self.lines()
+        response = self.client.patch(
+            self.path, {'name': 'Новое название'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.name, 'Новое название')
+        self.assertEqual(
+            set(self.recipe.tags.values_list('pk', flat=True)), tags
+        )
+        self.assertEqual(self.lines(), lines)
+
+    def test_replace_changed_lines_only(self):
+        kept, changed, *removed = self.ingredients
+        added = Ingredient.objects.create(name='перец', units='г')
+        lines = self.lines()
+        response = self.client.patch(self.path, {'ingredients': [
+            {'id': kept.pk, 'amount': lines[kept.pk][1]},
+            {'id': changed.pk, 'amount': 25},
+            {'id': added.pk, 'amount': 5},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        new_lines = self.lines()
+        self.assertEqual(set(new_lines), {kept.pk, changed.pk, added.pk})
+        self.assertEqual(new_lines[kept.pk], lines[kept.pk])
+        self.assertEqual(new_lines[changed.pk], (lines[changed.pk][0], 25))
+        self.assertEqual(new_lines[added.pk][1], 5)
+        self.assertEqual(
+            {
+                (user_id, ingredient_id): total
+                for user_id, ingredient_id, total in
+                ShoppingCartIngredient.objects.values_list(
+                    'user_id', 'ingredient_id', 'total_amount'
+                )
+            },
+            shopping_cart.expected_totals()
+        )
+
+
+class RecipeFragmentCacheTests(RecipeDataMixin, TestCase):
+    """Закешированные фрагменты рецептов устаревают вместе с данными"""
+
+    def ingredient_names(self):
+        response = self.client.get(f'/api/recipes/{self.recipes[0].pk}/')
+        return {item['name'] for item in response.data['ingredients']}
+
+    def test_ingredient_rename(self):
+        self.assertIn('мука', self.ingredient_names())
+        ingredient = self.ingredients[0]
+        ingredient.name = 'мука пшеничная'
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.save()
+        self.assertIn('мука пшеничная', self.ingredient_names())
+
+
+class ConditionalGetTests(RecipeDataMixin, TestCase):
+    """ETag списка рецептов меняется только вместе с отдаваемыми данными"""
+
+    path = '/api/recipes/'
+
+    def etag(self):
+        response = self.client.get(self.path)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def assertNotModified(self, etag):
+        response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_unrelated_user_saves_keep_etag(self):
+        etag = self.etag()
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create_user(
+                username='newcomer', email='newcomer@example.com',
+                password='p', first_name='Новый', last_name='Пользователь'
+            )
+            author = User.objects.get(pk=self.authors[0].pk)
+            author.set_password('another')
+            author.save()
+            author.last_login = author.date_joined
+            author.save(update_fields=['last_login'])
+        self.assertNotModified(etag)
+
+    def test_author_name_change(self):
+        etag = self.etag()
+        author = User.objects.get(pk=self.authors[0].pk)
+        author.first_name = 'Переименованный'
+        with self.captureOnCommitCallbacks(execute=True):
+            author.save()
+        self.assertNotEqual(self.etag(), etag)
+
+    def test_ingredient_rename(self):
+        etag = self.etag()
+        ingredient = self.ingredients[0]
+        ingredient.name = 'мука пшеничная'
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.save()
+        self.assertNotEqual(self.etag(), etag)
+
+    def test_recipe_delete_moves_last_modified(self):
+        response = self.client.get(self.path)
+        last_modified = response['Last-Modified']
+        # Last-Modified точен до секунды: удаление идет секундой позже.
+        later = time.time() + 2
+        with mock.patch('recipes.cache.time.time', return_value=later), \
+                self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.get(pk=self.recipes[-1].pk).delete()
+        response = self.client.get(
+            self.path, HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(
+            self.recipes[-1].pk,
+            [recipe['id'] for recipe in response.data['results']]
+        )
+
+    def test_popularity_ordering_is_not_cached(self):
+        for ordering in ('-favorites_count', 'pub_date,-in_carts_count'):
+            response = self.client.get(f'{self.path}?ordering={ordering}')
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('ETag', response)
+
+
+class ReferenceCacheTests(RecipeDataMixin, TestCase):
+    """Справочники отдаются с ETag и подтверждаются ответом 304"""
+
+    def test_ingredient_list(self):
+        for path in ('/api/ingredients/', '/api/ingredients/?name=мо'):
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('ETag', response)
+            with self.assertNumQueries(0):
+                response = self.client.get(
+                    path, HTTP_IF_NONE_MATCH=response['ETag']
+                )
+            self.assertEqual(response.status_code, 304)
+
+    def test_ingredient_list_follows_catalog(self):
+        etag = self.client.get('/api/ingredients/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='мед', units='г')
+        response = self.client.get(
+            '/api/ingredients/', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('мед', [item['name'] for item in response.data])
+
+
+class ImageSignatureTests(TestCase):
+    """Сигнатуры загружаемых картинок"""
+
+    def test_webp(self):
+        self.assertTrue(has_image_signature(b'RIFF\x10\x00\x00\x00WEBPVP8 '))
+
+    def test_other_riff(self):
+        for data in (b'RIFF\x10\x00\x00\x00WAVEfmt ', b'RIFF'):
+            self.assertFalse(has_image_signature(data))
+
+    def test_png(self):
+        self.assertTrue(has_image_signature(b'\x89PNG\r\n\x1a\n\x00'))
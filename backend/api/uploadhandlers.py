@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http.multipartparser import MultiPartParserError
+
+IMAGE_SIGNATURES = (
+    b'\x89PNG\r\n\x1a\n',
+    b'\xff\xd8\xff',
+    b'GIF87a',
+    b'GIF89a',
+)
+
+
+def has_image_signature(data):
+    """Начинаются ли данные с сигнатуры PNG, JPEG, GIF или WebP"""
+    if data[:4] == b'RIFF':
+        # RIFF - общий контейнер, WebP отличают байты 8-11.
+        return data[8:12] == b'WEBP'
+    return data.startswith(IMAGE_SIGNATURES)
+
+
+class RecipeImageUploadHandler(TemporaryFileUploadHandler):
+    """
+    Потоковая запись картинки рецепта во временный файл.
+
+    Размер и сигнатура формата проверяются по мере получения данных,
+    до того как картинку начнет разбирать Pillow.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        if (
+            self.content_length
+            and self.content_length > settings.RECIPE_IMAGE_MAX_SIZE
+        ):
+            raise MultiPartParserError('Картинка слишком большая.')
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        if start == 0 and not has_image_signature(raw_data):
+            raise MultiPartParserError(
+                'Поддерживаются картинки PNG, JPEG, GIF и WebP.'
+            )
+        self.received += len(raw_data)
+        if self.received > settings.RECIPE_IMAGE_MAX_SIZE:
+            raise MultiPartParserError('Картинка слишком большая.')
+        return super().receive_data_chunk(raw_data, start)
@@ -15,9 +15,14 @@ router.register(r'recipes', views.RecipeViewSet, basename='recipes')
 urlpatterns = [
     path(
         'users/subscriptions/',
-        views.SubscriptionsView.as_view({'get': 'list'})
+        views.SubscriptionsView.as_view({'get': 'list'}),
+        name='subscriptions'
+    ),
+    path(
+        'users/<int:user_id>/subscribe/',
+        views.SubscribeView.as_view(),
+        name='subscribe'
     ),
-    path('users/<int:user_id>/subscribe/', views.SubscribeView.as_view()),
     path('', include(router.urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
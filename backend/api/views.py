@@ -1,24 +1,62 @@
-from django.db.models import Sum
+import hashlib
+from urllib.parse import quote
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (BooleanField, Count, Max, OuterRef, Prefetch,
+                              Subquery, Value)
 from django_filters.rest_framework import DjangoFilterBackend
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from rest_framework import filters, status, viewsets
+from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 
-from recipes.models import (Tag, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Favorite)
+from recipes.models import (Tag, Ingredient, Recipe, ShoppingCart,
+                            ShoppingCartIngredient, Favorite)
+from recipes.cache import (INGREDIENTS, RECIPES, TAGS, USERS, get_versions,
+                           version_datetime, viewer_version_name)
+from recipes.search import ingredient_index, recipe_match_index
 from users.models import User, Subscribe
+from . import metrics as api_metrics
 from .filters import RecipeFilter
-from .mixins import ListViewSet, ListRetrieveViewSet
-from .pagination import CustomPaginator
+from .mixins import (ConditionalGetMixin, CursorPaginationMixin, ListViewSet,
+                     ListRetrieveViewSet, SerializerTimingMixin,
+                     VersionedCacheMixin)
+from .pagination import (CustomPaginator, RecipeCursorPaginator,
+                         SubscriptionsCursorPaginator)
+from .parsers import MultiPartJSONParser
 from .permissions import IsAuthorOrReadOnly
+from .profiling import timed_serializer
+from .renderers import (ShoppingCartCsvRenderer, ShoppingCartJsonRenderer,
+                        ShoppingCartTxtRenderer)
 from .serializers import (SubscriptionsSerializer, SubscribeSerializer,
                           TagSerializer, IngredientSerializer,
                           RecipeListSerializer, RecipeCreateSerializer,
-                          FavoriteSerializer, ShoppingCartSerializer)
+                          FavoriteSerializer, ShoppingCartSerializer,
+                          RecipeMatchSerializer, RecipeMatchParamsSerializer,
+                          get_recipes_limit)
+from .uploadhandlers import RecipeImageUploadHandler
+
+
+def attachment_header(filename, fallback):
+    """Content-Disposition с именем файла в UTF-8 и ASCII-запасным"""
+    return (
+        f'attachment; filename="{fallback}"; '
+        f"filename*=UTF-8''{quote(filename)}"
+    )
+
+
+def metrics(request):
+    """Метрики Prometheus; nginx этот путь наружу не проксирует"""
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    content, content_type = api_metrics.exposition()
+    return HttpResponse(content, content_type=content_type)
 
 
 class SubscribeView(APIView):
@@ -30,55 +68,173 @@ class SubscribeView(APIView):
             context={'request': request}
         )
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        with transaction.atomic():
+            serializer.save()
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete(self, request, user_id):
         author = get_object_or_404(User, id=user_id)
-        get_object_or_404(
-            Subscribe,
-            user=request.user,
-            author=author.id
-        ).delete()
+        with transaction.atomic():
+            get_object_or_404(
+                Subscribe,
+                user=request.user,
+                author=author.id
+            ).delete()
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class SubscriptionsView(ListViewSet):
+class SubscriptionsView(CursorPaginationMixin, ListViewSet):
     """Список подписок"""
+    cursor_pagination_class = SubscriptionsCursorPaginator
     serializer_class = SubscriptionsSerializer
 
     def get_queryset(self):
-        return User.objects.filter(subscribing__user=self.request.user)
+        limit = get_recipes_limit(self.request)
+        recipes = Recipe.objects.all()
+        if limit is not None:
+            recipes = recipes.filter(pk__in=Subquery(
+                Recipe.objects
+                .filter(author=OuterRef('author'))
+                .values('pk')[:limit]
+            ))
+        return (
+            User.objects
+            .filter(subscribing__user=self.request.user)
+            .annotate(
+                is_subscribed=Value(True, output_field=BooleanField())
+            )
+            .prefetch_related(
+                Prefetch(
+                    'recipes', queryset=recipes, to_attr='limited_recipes'
+                )
+            )
+        )
 
 
-class TagViewSet(ListRetrieveViewSet):
+class TagViewSet(VersionedCacheMixin, ListRetrieveViewSet):
     """Вьюсет тегов"""
+    cache_version_name = TAGS
     queryset = Tag.objects.all()
     permission_classes = (AllowAny,)
     serializer_class = TagSerializer
     pagination_class = None
 
 
-class IngredientViewSet(ListRetrieveViewSet):
+class IngredientViewSet(VersionedCacheMixin, ListRetrieveViewSet):
     """Вьюсет ингредиентов"""
+    cache_version_name = INGREDIENTS
     queryset = Ingredient.objects.all()
     permission_classes = (AllowAny,)
     serializer_class = IngredientSerializer
-    filter_backends = (filters.SearchFilter,)
-    search_fields = ('^name',)
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        # Поиск идет по индексу, а не по queryset, но ответ кешируется
+        # и получает ETag так же, как остальные справочники.
+        return self._cached(self._list, request, *args, **kwargs)
+
+    def _list(self, request, *args, **kwargs):
+        name = request.query_params.get(api_settings.SEARCH_PARAM)
+        if name:
+            ingredients = ingredient_index.search(name)
+        else:
+            ingredients = ingredient_index.all()
+        serializer = self.get_serializer(ingredients, many=True)
+        return Response(serializer.data)
+
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ConditionalGetMixin, CursorPaginationMixin,
+                    SerializerTimingMixin, viewsets.ModelViewSet):
     """Вьюсет рецептов"""
-    queryset = Recipe.objects.all()
     permission_classes = (IsAuthorOrReadOnly,)
     pagination_class = CustomPaginator
+    cursor_pagination_class = RecipeCursorPaginator
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
     http_method_names = ['get', 'post', 'patch', 'delete']
+    parser_classes = (JSONParser, MultiPartJSONParser)
+
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [RecipeImageUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def get_queryset(self):
+        if self.action == 'list':
+            return Recipe.objects.with_user_flags(self.request.user)
+        return Recipe.objects.for_read(self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        # Фильтр тегов проверяет слаги запросом к БД, поэтому выборка
+        # фильтруется один раз и передается и валидаторам, и списку.
+        queryset = self.filter_queryset(self.get_queryset())
+        return self._conditional(
+            self._list, request, *args, queryset=queryset, **kwargs
+        )
+
+    def _list(self, request, *args, queryset, **kwargs):
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        return Response(self.get_serializer(queryset, many=True).data)
+
+    @transaction.atomic
+    def perform_create(self, serializer):
+        serializer.save()
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+
+    def get_validators(self, request, *args, queryset=None, **kwargs):
+        ordering = request.query_params.get('ordering', '').split(',')
+        if any(
+            field.strip().lstrip('-') in RecipeFilter.POPULARITY_FIELDS
+            for field in ordering
+        ):
+            # Порядок зависит от чужих действий, которые не меняют рецепт.
+            return None
+        if queryset is not None:
+            state = queryset.aggregate(
+                updated_at=Max('updated_at'), count=Count('id')
+            )
+        else:
+            state = (
+                Recipe.objects.filter(pk=kwargs['pk'])
+                .values('updated_at', 'id')
+                .first()
+            )
+            if state is None:
+                return None
+        user = request.user
+        # RECIPES сдвигает Last-Modified и при удалении рецепта, которое
+        # не меняет ни одного updated_at.
+        names = [RECIPES, TAGS, INGREDIENTS, USERS]
+        if user.is_authenticated:
+            names.append(viewer_version_name(user.pk))
+        versions = get_versions(names)
+        fingerprint = ':'.join(str(value) for value in (
+            request.get_full_path(), user.pk, *state.values(),
+            *(versions[name] for name in names)
+        ))
+        last_modified = max(
+            version_datetime(version) for version in versions.values()
+        )
+        if state['updated_at'] is not None:
+            last_modified = max(last_modified, state['updated_at'])
+        return (
+            hashlib.md5(fingerprint.encode()).hexdigest(),
+            last_modified
+        )
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['image_variant'] = (
+            'preview' if self.action in ('list', 'match') else 'full'
+        )
+        return context
 
     def get_serializer_class(self):
         if self.action in ('list', 'retrieve'):
@@ -96,14 +252,20 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 context={'request': request}
             )
             serializer.is_valid(raise_exception=True)
-            serializer.save()
+            with transaction.atomic():
+                serializer.save()
 
             return Response(
                 serializer.data,
                 status=status.HTTP_201_CREATED
             )
 
-        get_object_or_404(Favorite, user=request.user, recipe=recipe).delete()
+        with transaction.atomic():
+            get_object_or_404(
+                Favorite,
+                user=request.user,
+                recipe=recipe
+            ).delete()
 
         return Response(
             {'detail': 'Рецепт успешно удален из избранного.'},
@@ -122,48 +284,85 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 context={'request': request}
             )
             serializer.is_valid(raise_exception=True)
-            serializer.save()
+            with transaction.atomic():
+                serializer.save()
 
             return Response(
                 serializer.data,
                 status=status.HTTP_201_CREATED
             )
 
-        get_object_or_404(
-            ShoppingCart,
-            user=request.user,
-            recipe=recipe
-        ).delete()
+        with transaction.atomic():
+            get_object_or_404(
+                ShoppingCart,
+                user=request.user,
+                recipe=recipe
+            ).delete()
 
         return Response(
             {'detail': 'Рецепт успешно удален из списка покупок.'},
             status=status.HTTP_204_NO_CONTENT
         )
 
+    @action(detail=False, methods=['get'], permission_classes=(AllowAny,))
+    def match(self, request):
+        """Рецепты, которые можно приготовить из переданных ингредиентов"""
+        params = RecipeMatchParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        matches = recipe_match_index.match(
+            params.validated_data['ingredients'],
+            params.validated_data['min_coverage']
+        )
+        page = self.paginate_queryset(matches)
+        recipes = Recipe.objects.with_user_flags(request.user).in_bulk(
+            [match.recipe_id for match in page]
+        )
+        found = []
+        for match in page:
+            recipe = recipes.get(match.recipe_id)
+            if recipe is not None:
+                recipe.match = match
+                found.append(recipe)
+        if len(found) < len(page):
+            # Рецепт удален после последнего обновления индекса.
+            recipe_match_index.discard(
+                match.recipe_id for match in page
+                if match.recipe_id not in recipes
+            )
+        serializer = timed_serializer(RecipeMatchSerializer(
+            found, many=True, context=self.get_serializer_context()
+        ))
+        return self.get_paginated_response(serializer.data)
+
     @action(detail=False, methods=['get'],
             permission_classes=(IsAuthenticated,),
-            pagination_class=None)
+            pagination_class=None,
+            renderer_classes=(ShoppingCartTxtRenderer,
+                              ShoppingCartCsvRenderer,
+                              ShoppingCartJsonRenderer))
     def download_shopping_cart(self, request, **kwargs):
-        filename = 'foodgram_shopping_cart.txt'
+        renderer = request.accepted_renderer
         ingredients = (
-            RecipeIngredient.objects
-            .filter(recipe__shopping_cart__user=request.user)
-            .values('ingredient')
-            .annotate(total_amount=Sum('amount'))
+            ShoppingCartIngredient.objects
+            .filter(user=request.user)
+            .order_by('ingredient__name', 'ingredient__units')
             .values_list(
                 'ingredient__name',
                 'total_amount',
                 'ingredient__units'
             )
+            .iterator(chunk_size=500)
+        )
+        file = StreamingHttpResponse(
+            (
+                chunk.encode(renderer.charset)
+                for chunk in renderer.stream(ingredients)
+            ),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
         )
-        file_list = []
-        [file_list.append(
-            '{} - {} {}.'.format(*ingredient)
-        ) for ingredient in ingredients]
-        file = HttpResponse(
-            'Cписок покупок:\n' + '\n'.join(file_list),
-            content_type='text/plain'
+        file['Content-Disposition'] = attachment_header(
+            f'список_покупок.{renderer.format}',
+            f'foodgram_shopping_cart.{renderer.format}'
         )
-        file['Content-Disposition'] = f'attachment; filename={filename}'
 
         return file
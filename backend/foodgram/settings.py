@@ -10,6 +10,14 @@ SECRET_KEY = os.getenv('SECRET_KEY')
 
 DEBUG = False
 
+REQUEST_PROFILING = os.getenv('REQUEST_PROFILING', 'False') == 'True'
+REQUEST_PROFILING_SAMPLE_RATE = float(
+    os.getenv('REQUEST_PROFILING_SAMPLE_RATE', 1)
+)
+REQUEST_PROFILING_SLOW_MS = int(os.getenv('REQUEST_PROFILING_SLOW_MS', 500))
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+
 ALLOWED_HOSTS = [
     'localhost',
     '127.0.0.1',
@@ -34,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
+    'api.middleware.RequestProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -45,6 +55,21 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'foodgram.urls'
 
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.middleware': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -74,6 +99,25 @@ DATABASES = {
     }
 }
 
+LOCMEM_CACHE = 'django.core.cache.backends.locmem.LocMemCache'
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', LOCMEM_CACHE),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    }
+}
+# Версии наборов данных в кеше. В кеше процесса не видны изменения из
+# других воркеров и команд, поэтому там версия живет ограниченное время;
+# в общем кеше (Redis, Memcached) - без срока.
+CACHE_VERSION_TTL = (
+    60 if CACHES['default']['BACKEND'] == LOCMEM_CACHE else None
+)
+if os.getenv('CACHE_VERSION_TTL'):
+    CACHE_VERSION_TTL = int(os.getenv('CACHE_VERSION_TTL'))
+
+REFERENCE_CACHE_TTL = 60 * 60
+RECIPE_FRAGMENT_CACHE_TTL = 60 * 60
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -105,8 +149,22 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+RECIPE_IMAGE_VARIANTS = {
+    'thumbnail': 320,
+    'preview': 720,
+    'full': None,
+}
+IMAGE_WEBP_QUALITY = 80
+RECIPE_IMAGE_MAX_SIZE = 10 * 1024 * 1024
+IMAGE_PROCESSING_WORKERS = int(os.getenv('IMAGE_PROCESSING_WORKERS', 2))
+
 AUTH_USER_MODEL = 'users.User'
 
+INGREDIENT_SEARCH_LIMIT = 50
+INGREDIENT_INDEX_TTL = 300
+RECIPE_MATCH_INDEX_TTL = 60 * 60
+RECIPE_MATCH_MIN_COVERAGE = 0.5
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
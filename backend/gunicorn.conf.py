@@ -0,0 +1,20 @@
+import os
+import shutil
+
+# Воркеры пишут метрики в общий каталог, /metrics собирает их вместе.
+# prometheus_client выбирает файловое хранение значений при импорте,
+# поэтому переменная задается раньше любого импорта клиента.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus')
+
+
+def on_starting(server):
+    # Файлы прошлого запуска исказили бы счетчики нового.
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
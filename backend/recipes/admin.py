@@ -1,7 +1,7 @@
 from django.contrib.admin import ModelAdmin, register
 
 from .models import (Favorite, Ingredient, RecipeIngredient, Recipe,
-                     ShoppingCart, Tag)
+                     ShoppingCart, ShoppingCartIngredient, Tag)
 
 
 @register(Tag)
@@ -27,7 +27,9 @@ class RecipeIngredientAdmin(ModelAdmin):
 
 @register(Recipe)
 class RecipeAdmin(ModelAdmin):
-    list_display = ('pk', 'name', 'author')
+    list_display = (
+        'pk', 'name', 'author', 'favorites_count', 'in_carts_count'
+    )
     list_filter = ('name', 'author', 'tags')
     empty_value_display = '-пусто-'
 
@@ -38,6 +40,12 @@ class ShoppingListAdmin(ModelAdmin):
     empty_value_display = '-пусто-'
 
 
+@register(ShoppingCartIngredient)
+class ShoppingCartIngredientAdmin(ModelAdmin):
+    list_display = ('user', 'ingredient', 'total_amount')
+    empty_value_display = '-пусто-'
+
+
 @register(Favorite)
 class FavoriteAdmin(ModelAdmin):
     list_display = ('user', 'recipe')
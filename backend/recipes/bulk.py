@@ -0,0 +1,113 @@
+import csv
+import io
+import json
+from itertools import islice
+
+from django.db import connection
+
+# Пустая строка без кавычек в CSV для COPY - это NULL, поэтому NULL
+# обозначается отдельно, а пустые строки остаются строками.
+COPY_NULL = r'\N'
+
+
+def batched(iterable, size):
+    """Разбить поток на списки не длиннее size"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _copy_insert_ignore(model, fields, rows):
+    """
+    Вставка через COPY во временную таблицу и INSERT ... ON CONFLICT.
+
+    Должна выполняться внутри транзакции: таблица удаляется при коммите.
+    """
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    temp_table = quote(f'{model._meta.db_table}_load')
+    columns = ', '.join(
+        quote(model._meta.get_field(field).column) for field in fields
+    )
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE TEMP TABLE IF NOT EXISTS {temp_table} ON COMMIT DROP '
+            f'AS SELECT {columns} FROM {table} WITH NO DATA'
+        )
+        cursor.copy_expert(
+            f'COPY {temp_table} ({columns}) FROM STDIN WITH (FORMAT csv)',
+            buffer
+        )
+        cursor.execute(
+            f'INSERT INTO {table} ({columns}) '
+            f'SELECT {columns} FROM {temp_table} ON CONFLICT DO NOTHING'
+        )
+        cursor.execute(f'TRUNCATE {temp_table}')
+
+
+def insert_ignore(model, fields, rows):
+    """
+    Вставить строки rows (кортежи значений fields), пропуская конфликты.
+
+    На PostgreSQL данные передаются через COPY, на остальных базах -
+    через bulk_create(ignore_conflicts=True). Сигналы не отправляются.
+    """
+    if connection.vendor == 'postgresql':
+        _copy_insert_ignore(model, fields, rows)
+        return
+    model.objects.bulk_create(
+        [model(**dict(zip(fields, row))) for row in rows],
+        ignore_conflicts=True
+    )
+
+
+def _copy_value(value):
+    if value is None:
+        return COPY_NULL
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def insert_rows(model, fields, rows):
+    """
+    Вставить строки rows (кортежи значений fields) как есть.
+
+    На PostgreSQL - через COPY, на остальных базах - одним executemany.
+    В отличие от bulk_create, значения auto_now_add и первичные ключи
+    не подменяются. Сигналы не отправляются.
+    """
+    quote = connection.ops.quote_name
+    model_fields = [model._meta.get_field(field) for field in fields]
+    table = quote(model._meta.db_table)
+    columns = ', '.join(quote(field.column) for field in model_fields)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(
+                [_copy_value(value) for value in row] for row in rows
+            )
+            buffer.seek(0)
+            cursor.copy_expert(
+                f'COPY {table} ({columns}) FROM STDIN '
+                f"WITH (FORMAT csv, NULL '{COPY_NULL}')",
+                buffer
+            )
+            return
+        placeholders = ', '.join(['%s'] * len(model_fields))
+        cursor.executemany(
+            f'INSERT INTO {table} ({columns}) VALUES ({placeholders})',
+            [
+                [
+                    field.get_db_prep_save(value, connection)
+                    for field, value in zip(model_fields, row)
+                ]
+                for row in rows
+            ]
+        )
@@ -0,0 +1,70 @@
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+
+INGREDIENTS = 'ingredients'
+# Состав рецептов: меняется при сохранении и удалении любого рецепта.
+RECIPE_INGREDIENTS = 'recipe_ingredients'
+# Набор рецептов: меняется при создании, изменении и удалении рецепта.
+RECIPES = 'recipes'
+TAGS = 'tags'
+USERS = 'users'
+
+
+def _version_key(name):
+    return f'{name}_version'
+
+
+def _now_version():
+    # Версия - время изменения в миллисекундах, поэтому версия,
+    # вытесненная из кеша, не совпадет с уже выданной.
+    return int(time.time() * 1000)
+
+
+def version_datetime(version):
+    """Время изменения, соответствующее версии"""
+    return datetime.fromtimestamp(version / 1000, tz=timezone.utc)
+
+
+def recipe_version_name(recipe_id):
+    return f'recipe_{recipe_id}'
+
+
+def user_version_name(user_id):
+    return f'user_{user_id}'
+
+
+def viewer_version_name(user_id):
+    """Избранное, корзина и подписки пользователя"""
+    return f'viewer_{user_id}'
+
+
+def get_versions(names):
+    """Текущие версии наборов данных names одним обращением к кешу"""
+    keys = {_version_key(name): name for name in names}
+    versions = cache.get_many(list(keys))
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, _now_version(), timeout=settings.CACHE_VERSION_TTL)
+        versions.update(cache.get_many(missing))
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def get_version(name):
+    """Текущая версия набора данных name"""
+    return get_versions([name])[name]
+
+
+def bump_version(name):
+    """Пометить закешированные данные набора name устаревшими"""
+    key = _version_key(name)
+    if cache.add(key, _now_version(), timeout=settings.CACHE_VERSION_TTL):
+        return
+    try:
+        current = cache.get(key, 0)
+        cache.incr(key, max(1, _now_version() - current))
+    except ValueError:
+        cache.set(key, _now_version(), timeout=settings.CACHE_VERSION_TTL)
@@ -0,0 +1,69 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from users.models import Subscribe, User
+from .models import Favorite, Recipe, ShoppingCart
+
+# Счетчик: (модель, поле, связанная модель, поле связи).
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Subscribe, 'author'),
+)
+COUNTED_MODELS = {related_model for _, _, related_model, _ in COUNTERS}
+
+
+def change(model, pk, field, delta):
+    """
+    Изменить счетчик одной строкой UPDATE с F(), без чтения значения.
+
+    Уменьшение не опускает счетчик ниже нуля, если он разошелся с данными.
+    """
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def related_changed(related_model, instance, delta):
+    """Учесть создание или удаление строки связанной модели"""
+    for model, field, counted_model, related_field in COUNTERS:
+        if counted_model is related_model:
+            change(
+                model, getattr(instance, f'{related_field}_id'), field, delta
+            )
+
+
+def actual_count(related_model, related_field):
+    return Coalesce(
+        Subquery(
+            related_model.objects
+            .filter(**{related_field: OuterRef('pk')})
+            .order_by()
+            .values(related_field)
+            .annotate(count=Count('pk'))
+            .values('count'),
+            output_field=IntegerField()
+        ),
+        0
+    )
+
+
+def reconcile(verify=False):
+    """
+    Сверить счетчики с данными и исправить расхождения.
+
+    Возвращает {'Модель.поле': число расходящихся строк}.
+    """
+    drift = {}
+    for model, field, related_model, related_field in COUNTERS:
+        drifted = model.objects.alias(
+            actual=actual_count(related_model, related_field)
+        ).filter(~Q(**{field: F('actual')}))
+        drift[f'{model.__name__}.{field}'] = drifted.count()
+        if not verify:
+            drifted.update(**{field: actual_count(
+                related_model, related_field
+            )})
+    return drift
@@ -0,0 +1,113 @@
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image, ImageOps
+
+from .cache import bump_version, recipe_version_name
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = 'recipes/images/variants'
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_PROCESSING_WORKERS,
+            thread_name_prefix='recipe-images'
+        )
+    return _executor
+
+
+def variant_name(name, variant, max_side):
+    """
+    Имя варианта картинки name.
+
+    В имя входят расширение исходника, чтобы foo.png и foo.jpg не делили
+    варианты, а также размер и качество WebP: после смены настроек
+    вариант получает новое имя и строится заново. Файл по имени никогда
+    не переписывается, и nginx отдает его как неизменяемый.
+    """
+    stem, extension = os.path.splitext(os.path.basename(name))
+    extension = extension.lstrip('.').lower()
+    return (
+        f'{VARIANTS_DIR}/{stem}_{extension}_{variant}_{max_side or "full"}'
+        f'_q{settings.IMAGE_WEBP_QUALITY}.webp'
+    )
+
+
+def expected_variants(name):
+    """Значение image_variants для картинки name при текущих настройках"""
+    variants = {'source': name}
+    for variant, max_side in settings.RECIPE_IMAGE_VARIANTS.items():
+        variants[variant] = variant_name(name, variant, max_side)
+    return variants
+
+
+def render_variant(image, max_side):
+    """Уменьшенная до max_side копия картинки в формате WebP"""
+    variant = image.copy()
+    if max_side is not None:
+        variant.thumbnail((max_side, max_side), Image.LANCZOS)
+    buffer = io.BytesIO()
+    variant.save(buffer, 'WEBP', quality=settings.IMAGE_WEBP_QUALITY)
+    return buffer.getvalue()
+
+
+def build_variants(recipe_id, name):
+    """
+    Сохранить варианты картинки рецепта и записать их в image_variants.
+
+    Варианты записываются, только если картинка рецепта не сменилась,
+    пока шла обработка.
+    """
+    try:
+        with default_storage.open(name) as file:
+            image = ImageOps.exif_transpose(Image.open(file))
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        variants = {'source': name}
+        for variant, max_side in settings.RECIPE_IMAGE_VARIANTS.items():
+            path = variant_name(name, variant, max_side)
+            if not default_storage.exists(path):
+                path = default_storage.save(
+                    path, ContentFile(render_variant(image, max_side))
+                )
+            variants[variant] = path
+        updated = Recipe.objects.filter(pk=recipe_id, image=name).update(
+            image_variants=variants
+        )
+        if updated:
+            bump_version(recipe_version_name(recipe_id))
+    except Exception:
+        logger.exception('Не удалось обработать картинку %s', name)
+
+
+def build_variants_job(recipe_id, name):
+    """build_variants в потоке пула; поток закрывает свое соединение"""
+    try:
+        build_variants(recipe_id, name)
+    finally:
+        connection.close()
+
+
+def schedule_variants(recipe):
+    """Запустить обработку картинки рецепта после фиксации транзакции"""
+    recipe_id, name = recipe.pk, recipe.image.name
+
+    def submit():
+        if settings.IMAGE_PROCESSING_WORKERS:
+            get_executor().submit(build_variants_job, recipe_id, name)
+        else:
+            build_variants(recipe_id, name)
+
+    transaction.on_commit(submit)
@@ -0,0 +1,484 @@
+import base64
+import gc
+import io
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from itertools import cycle
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Max
+from django.test.runner import DiscoverRunner
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+from PIL import Image
+from rest_framework.test import APIClient
+
+from recipes.cache import (INGREDIENTS, RECIPE_INGREDIENTS, RECIPES, TAGS,
+                           USERS, bump_version)
+from recipes.counters import reconcile
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
+from users.models import Subscribe, User
+
+DEFAULT_BASELINE = os.path.join(
+    settings.BASE_DIR, 'benchmarks', 'baseline.json'
+)
+
+
+def percentile(values, share):
+    """Перцентиль по ближайшему рангу"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def png_data_uri():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), (200, 120, 40)).save(buffer, 'PNG')
+    return (
+        'data:image/png;base64,'
+        + base64.b64encode(buffer.getvalue()).decode()
+    )
+
+
+class QueryCounter:
+    """Обертка для connection.execute_wrapper, считающая запросы"""
+
+    def __init__(self):
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+class Dataset:
+    """
+    Набор данных, который наращивается до заданного числа рецептов.
+
+    Пользователей в 5 раз меньше, чем рецептов, отметок «в избранном»
+    вдвое больше, рецептов в корзинах и подписок - по половине от числа
+    рецептов. Первый пользователь - зритель, от имени которого идут
+    запросы: у него есть подписки, избранное, корзина и свои рецепты.
+    """
+
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+        self.password = make_password('benchmark')
+        self.users = []
+        self.recipes = []
+        self.own_recipes = []
+        self.tags = []
+        self.ingredients = []
+
+    @property
+    def viewer(self):
+        return self.users[0]
+
+    def grow(self, size):
+        if not self.tags:
+            self.create_reference()
+        self.create_users(max(20, size // 5))
+        new_recipes = self.create_recipes(size - len(self.recipes))
+        self.create_relations(new_recipes)
+        reconcile()
+        call_command('rebuild_shopping_cart_totals', stdout=io.StringIO())
+        for name in (INGREDIENTS, RECIPE_INGREDIENTS, RECIPES, TAGS, USERS):
+            bump_version(name)
+
+    def create_reference(self):
+        call_command(
+            'load_data', os.path.join(settings.BASE_DIR, 'data',
+                                      'ingredients.csv'),
+            verbosity=0, stdout=io.StringIO()
+        )
+        if not Ingredient.objects.exists():
+            Ingredient.objects.bulk_create(
+                Ingredient(name=f'ингредиент {number}', units='г')
+                for number in range(1000)
+            )
+        Tag.objects.bulk_create(
+            Tag(
+                name=f'Тег {number}',
+                color=f'#{number * 20:02x}80c0',
+                slug=f'tag{number}'
+            )
+            for number in range(12)
+        )
+        self.tags = list(Tag.objects.values_list('pk', 'slug'))
+        self.ingredients = list(
+            Ingredient.objects.values_list('pk', 'name')
+        )
+
+    def create_users(self, count):
+        start = len(self.users)
+        if count <= start:
+            return
+        User.objects.bulk_create(
+            (
+                User(
+                    username=f'bench{number}',
+                    email=f'bench{number}@example.com',
+                    first_name='Bench',
+                    last_name=str(number),
+                    password=self.password,
+                )
+                for number in range(start, count)
+            ),
+            batch_size=1000
+        )
+        self.users = list(
+            User.objects.filter(username__startswith='bench')
+            .order_by('pk').values_list('pk', flat=True)
+        )
+
+    def create_recipes(self, count):
+        if count <= 0:
+            return []
+        last_pk = Recipe.objects.aggregate(last=Max('pk'))['last'] or 0
+        authors = [self.viewer] + self.random.choices(self.users, k=count - 1)
+        Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    author_id=author,
+                    name=f'Рецепт {len(self.recipes) + number}',
+                    text='Смешать, довести до кипения и подать.',
+                    cooking_time=self.random.randint(5, 120),
+                )
+                for number, author in enumerate(authors)
+            ),
+            batch_size=1000
+        )
+        new_recipes = list(
+            Recipe.objects.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', 'author_id')
+        )
+        RecipeIngredient.objects.bulk_create(
+            (
+                RecipeIngredient(
+                    recipe_id=recipe,
+                    ingredient_id=ingredient,
+                    amount=self.random.randint(1, 500)
+                )
+                for recipe, _ in new_recipes
+                for ingredient, _ in self.random.sample(
+                    self.ingredients, self.random.randint(3, 10)
+                )
+            ),
+            batch_size=5000
+        )
+        RecipeTag = Recipe.tags.through
+        RecipeTag.objects.bulk_create(
+            (
+                RecipeTag(recipe_id=recipe, tag_id=tag)
+                for recipe, _ in new_recipes
+                for tag, _ in self.random.sample(
+                    self.tags, self.random.randint(1, 3)
+                )
+            ),
+            batch_size=5000
+        )
+        new_pks = [recipe for recipe, _ in new_recipes]
+        self.recipes.extend(new_pks)
+        self.own_recipes.extend(
+            recipe for recipe, author in new_recipes if author == self.viewer
+        )
+        return new_pks
+
+    def pairs(self, users, recipes, count):
+        return {
+            (self.random.choice(users), self.random.choice(recipes))
+            for _ in range(count)
+        }
+
+    def create_relations(self, new_recipes):
+        if not new_recipes:
+            return
+        count = len(new_recipes)
+        viewer_recipes = self.random.sample(new_recipes, min(10, count))
+        favorites = self.pairs(self.users, new_recipes, count * 2)
+        favorites.update((self.viewer, recipe) for recipe in viewer_recipes)
+        carts = self.pairs(self.users, new_recipes, count // 2)
+        carts.update((self.viewer, recipe) for recipe in viewer_recipes)
+        carts.add((self.viewer, self.own_recipes[0]))
+        subscriptions = {
+            (user, author)
+            for user, author in self.pairs(self.users, self.users, count // 2)
+            if user != author
+        }
+        subscriptions.update(
+            (self.viewer, author)
+            for author in self.random.sample(self.users[1:], 10)
+        )
+        for model, fields, rows in (
+            (Favorite, ('user_id', 'recipe_id'), favorites),
+            (ShoppingCart, ('user_id', 'recipe_id'), carts),
+            (Subscribe, ('user_id', 'author_id'), subscriptions),
+        ):
+            model.objects.bulk_create(
+                (model(**dict(zip(fields, row))) for row in rows),
+                batch_size=5000,
+                ignore_conflicts=True
+            )
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark API endpoints on a throwaway database and compare '
+        'latency and SQL query counts with a stored baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            default='100,1000',
+            help='Comma separated dataset sizes, in recipes.'
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=50,
+            help='Measured requests per endpoint and dataset size.'
+        )
+        parser.add_argument(
+            '--warmup',
+            type=int,
+            default=3,
+            help='Unmeasured requests before each endpoint.'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--baseline',
+            default=DEFAULT_BASELINE,
+            help='Baseline JSON file to compare with or to save.'
+        )
+        parser.add_argument(
+            '--save-baseline',
+            action='store_true',
+            help='Store the results as the new baseline.'
+        )
+        parser.add_argument(
+            '--latency-tolerance',
+            type=float,
+            default=0.5,
+            help='Allowed p95 latency growth over the baseline, as a share.'
+        )
+        parser.add_argument(
+            '--latency-slack-ms',
+            type=float,
+            default=5.0,
+            help='Allowed absolute p95 latency growth, for fast endpoints.'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted({int(size) for size in options['sizes'].split(',')})
+        except ValueError:
+            raise CommandError('--sizes must be comma separated integers.')
+        if not sizes or sizes[0] < 1 or options['requests'] < 1:
+            raise CommandError('Sizes and --requests must be positive.')
+        results = self.run(sizes, options)
+        regressions = self.check_scaling(results)
+        if options['save_baseline']:
+            with open(options['baseline'], 'w') as file:
+                json.dump(results, file, indent=2, sort_keys=True)
+            self.stdout.write(f'Baseline saved to {options["baseline"]}.')
+        elif os.path.exists(options['baseline']):
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+            regressions += self.compare(
+                results, baseline,
+                options['latency_tolerance'], options['latency_slack_ms']
+            )
+        else:
+            self.stdout.write(
+                f'No baseline at {options["baseline"]}, '
+                'run with --save-baseline to create it.'
+            )
+        if regressions:
+            for regression in regressions:
+                self.stderr.write(f'REGRESSION {regression}')
+            raise CommandError(f'{len(regressions)} regressions found.')
+
+    def run(self, sizes, options):
+        results = {}
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            with tempfile.TemporaryDirectory() as media_root, \
+                    override_settings(MEDIA_ROOT=media_root):
+                dataset = Dataset(options['seed'])
+                for size in sizes:
+                    started = time.perf_counter()
+                    dataset.grow(size)
+                    self.stdout.write(
+                        f'Dataset of {size} recipes ready in '
+                        f'{time.perf_counter() - started:.1f}s.'
+                    )
+                    results[str(size)] = self.measure_all(dataset, options)
+        finally:
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+        return results
+
+    def scenarios(self, dataset):
+        """(название, функция, возвращающая метод, путь и данные запроса)"""
+        rng = dataset.random
+        image = png_data_uri()
+
+        # Обновляется один рецепт из корзины зрителя, состав чередуется
+        # между двумя наборами: каждое обновление меняет все строки, и
+        # число запросов не зависит от случая.
+        updated_recipe = dataset.own_recipes[0]
+        compositions = cycle(
+            (dataset.ingredients[:6], dataset.ingredients[6:12])
+        )
+
+        def recipe_payload(ingredients):
+            return {
+                'name': 'Рецепт для замера',
+                'text': 'Смешать и запечь.',
+                'cooking_time': rng.randint(5, 120),
+                'tags': [pk for pk, _ in rng.sample(dataset.tags, 2)],
+                'ingredients': [
+                    {'id': pk, 'amount': rng.randint(1, 500)}
+                    for pk, _ in ingredients
+                ],
+            }
+
+        def list_recipes():
+            return 'get', f'/api/recipes/?page={rng.randint(1, 5)}', None
+
+        def list_by_tags():
+            slugs = [slug for _, slug in rng.sample(dataset.tags, 2)]
+            return 'get', '/api/recipes/?' + '&'.join(
+                f'tags={slug}' for slug in slugs
+            ), None
+
+        def retrieve_recipe():
+            return 'get', f'/api/recipes/{rng.choice(dataset.recipes)}/', None
+
+        def create_recipe():
+            payload = {
+                **recipe_payload(rng.sample(dataset.ingredients, 6)),
+                'image': image
+            }
+            return 'post', '/api/recipes/', payload
+
+        def update_recipe():
+            return (
+                'patch', f'/api/recipes/{updated_recipe}/',
+                recipe_payload(next(compositions))
+            )
+
+        def subscriptions():
+            return 'get', '/api/users/subscriptions/?recipes_limit=3', None
+
+        def search_ingredients():
+            _, name = rng.choice(dataset.ingredients)
+            return 'get', f'/api/ingredients/?name={name[:3]}', None
+
+        def download_shopping_cart():
+            return 'get', '/api/recipes/download_shopping_cart/', None
+
+        return (
+            ('recipes list', list_recipes),
+            ('recipes list by tags', list_by_tags),
+            ('recipe retrieve', retrieve_recipe),
+            ('recipe create', create_recipe),
+            ('recipe update', update_recipe),
+            ('subscriptions', subscriptions),
+            ('ingredients search', search_ingredients),
+            ('download shopping cart', download_shopping_cart),
+        )
+
+    def measure_all(self, dataset, options):
+        client = APIClient()
+        client.force_authenticate(User.objects.get(pk=dataset.viewer))
+        results = {}
+        self.stdout.write(
+            f'{"endpoint":24} {"p50 ms":>8} {"p95 ms":>8} '
+            f'{"req/s":>8} {"queries":>8}'
+        )
+        for name, make_request in self.scenarios(dataset):
+            durations, queries = [], []
+            # Первый запрос каждой точки идет на холодный кеш, и число
+            # запросов к БД считается по всем запросам, включая прогрев.
+            cache.clear()
+            gc.collect()
+            for number in range(options['warmup'] + options['requests']):
+                method, path, data = make_request()
+                counter = QueryCounter()
+                with connection.execute_wrapper(counter):
+                    started = time.perf_counter()
+                    response = getattr(client, method)(
+                        path, data, format='json'
+                    )
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    duration = time.perf_counter() - started
+                if response.status_code >= 400:
+                    raise CommandError(
+                        f'{name}: {method.upper()} {path} returned '
+                        f'{response.status_code}: {response.content[:200]}'
+                    )
+                queries.append(counter.queries)
+                if number >= options['warmup']:
+                    durations.append(duration)
+            results[name] = {
+                'p50_ms': round(statistics.median(durations) * 1000, 2),
+                'p95_ms': round(percentile(durations, 0.95) * 1000, 2),
+                'rps': round(len(durations) / sum(durations), 1),
+                'queries': max(queries),
+            }
+            self.stdout.write(
+                f'{name:24} {results[name]["p50_ms"]:8.2f} '
+                f'{results[name]["p95_ms"]:8.2f} '
+                f'{results[name]["rps"]:8.1f} {results[name]["queries"]:8}'
+            )
+        return results
+
+    def check_scaling(self, results):
+        """Число запросов не должно зависеть от объема данных"""
+        sizes = sorted(results, key=int)
+        smallest = results[sizes[0]]
+        return [
+            f'{name}: {stats["queries"]} queries on {size} recipes, '
+            f'{smallest[name]["queries"]} on {sizes[0]}'
+            for size in sizes[1:]
+            for name, stats in results[size].items()
+            if stats['queries'] > smallest[name]['queries']
+        ]
+
+    def compare(self, results, baseline, tolerance, slack_ms):
+        regressions = []
+        for size, endpoints in results.items():
+            for name, stats in endpoints.items():
+                expected = baseline.get(size, {}).get(name)
+                if expected is None:
+                    continue
+                if stats['queries'] > expected['queries']:
+                    regressions.append(
+                        f'{name} on {size} recipes: {stats["queries"]} '
+                        f'queries, baseline {expected["queries"]}'
+                    )
+                allowed = max(
+                    expected['p95_ms'] * (1 + tolerance),
+                    expected['p95_ms'] + slack_ms
+                )
+                if stats['p95_ms'] > allowed:
+                    regressions.append(
+                        f'{name} on {size} recipes: p95 '
+                        f'{stats["p95_ms"]:.2f}ms, baseline '
+                        f'{expected["p95_ms"]:.2f}ms'
+                    )
+        return regressions
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import build_variants, expected_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Build thumbnail and WebP variants of recipe images'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Rebuild variants of every recipe, not only missing ones.'
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='').only(
+            'id', 'image', 'image_variants'
+        )
+        built = 0
+        for recipe in recipes.iterator():
+            if (
+                options['all']
+                or recipe.image_variants != expected_variants(
+                    recipe.image.name
+                )
+            ):
+                build_variants(recipe.pk, recipe.image.name)
+                built += 1
+        self.stdout.write(f'{built} recipe images have been processed.')
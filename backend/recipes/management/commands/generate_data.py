@@ -0,0 +1,193 @@
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from recipes.cache import (INGREDIENTS, RECIPE_INGREDIENTS, RECIPES, TAGS,
+                           USERS, bump_version)
+from recipes.counters import reconcile
+from recipes.models import Ingredient, Recipe, Tag
+from recipes.synthetic import CHUNK_SIZE, PHASES, Plan
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate synthetic users, recipes, favorites, carts and '
+        'subscriptions with skewed (Zipf) distributions'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            help='Number of recipes, by default equal to --users.'
+        )
+        parser.add_argument(
+            '--favorites-per-user',
+            type=float,
+            default=10.0,
+            help='Average number of favorites per user.'
+        )
+        parser.add_argument(
+            '--carts-per-user',
+            type=float,
+            default=2.0,
+            help='Average number of recipes in a shopping cart.'
+        )
+        parser.add_argument(
+            '--subscriptions-per-user',
+            type=float,
+            default=5.0,
+            help='Average number of subscriptions per user.'
+        )
+        parser.add_argument(
+            '--tags',
+            type=int,
+            default=20,
+            help='Minimal number of tags, missing ones are created.'
+        )
+        parser.add_argument(
+            '--exponent',
+            type=float,
+            default=1.1,
+            help='Zipf exponent of author, recipe and ingredient popularity.'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Worker processes; SQLite always uses one.'
+        )
+
+    def handle(self, *args, **options):
+        recipes = options['recipes']
+        if recipes is None:
+            recipes = options['users']
+        if min(options['users'], recipes, options['tags']) < 1:
+            raise CommandError(
+                '--users, --recipes and --tags must be positive.'
+            )
+        workers = options['workers']
+        if connection.vendor == 'sqlite':
+            # Запись в SQLite идет под блокировкой всей базы.
+            workers = 1
+        started = time.monotonic()
+        with transaction.atomic():
+            plan = Plan(
+                seed=options['seed'],
+                exponent=options['exponent'],
+                first_user=self.next_pk(User),
+                users=options['users'],
+                first_recipe=self.next_pk(Recipe),
+                recipes=recipes,
+                ingredients=self.ingredients(),
+                tags=self.tags(options['tags']),
+                favorites=options['favorites_per_user'],
+                carts=options['carts_per_user'],
+                subscriptions=options['subscriptions_per_user'],
+            )
+        rows = sum(
+            self.run_phase(plan, phase, workers, options['verbosity'])
+            for phase in PHASES
+        )
+        with transaction.atomic():
+            self.finish()
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'{rows} rows generated in {elapsed:.1f}s '
+            f'({rows / max(elapsed, 1e-6):.0f} rows/s).'
+        )
+
+    def next_pk(self, model):
+        return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+    def ingredients(self):
+        if not Ingredient.objects.exists():
+            call_command(
+                'load_data',
+                os.path.join(settings.BASE_DIR, 'data', 'ingredients.csv'),
+                verbosity=0, stdout=io.StringIO()
+            )
+        ingredients = list(
+            Ingredient.objects.order_by('pk').values_list('pk', flat=True)
+        )
+        if not ingredients:
+            raise CommandError('No ingredients, run load_data first.')
+        return ingredients
+
+    def tags(self, count):
+        missing = count - Tag.objects.count()
+        if missing > 0:
+            Tag.objects.bulk_create(
+                (
+                    Tag(
+                        name=f'Тег {number}',
+                        color=f'#{number * 40503 % 0xffffff:06x}',
+                        slug=f'synthetic-{number}'
+                    )
+                    for number in range(missing)
+                ),
+                ignore_conflicts=True
+            )
+        return list(Tag.objects.order_by('pk').values_list('pk', flat=True))
+
+    def run_phase(self, plan, phase, workers, verbosity):
+        name, generate, size_field = phase
+        size = getattr(plan, size_field)
+        chunks = [
+            (start, min(start + CHUNK_SIZE, size))
+            for start in range(0, size, CHUNK_SIZE)
+        ]
+        started = time.monotonic()
+        rows = 0
+        if workers > 1 and len(chunks) > 1:
+            # Дочерние процессы открывают свои соединения с базой.
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=min(workers, len(chunks)),
+                initializer=django.setup
+            ) as executor:
+                done = as_completed(
+                    executor.submit(generate, plan, start, stop)
+                    for start, stop in chunks
+                )
+                for future in done:
+                    rows += future.result()
+                    self.progress(name, rows, started, verbosity)
+        else:
+            for start, stop in chunks:
+                rows += generate(plan, start, stop)
+                self.progress(name, rows, started, verbosity)
+        return rows
+
+    def progress(self, name, rows, started, verbosity):
+        if verbosity > 0:
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f'{name}: {rows} rows, '
+                f'{rows / max(elapsed, 1e-6):.0f} rows/s'
+            )
+
+    def finish(self):
+        """Счетчики, последовательности ключей, статистика и кеш"""
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(
+                no_style(), [User, Recipe]
+            ):
+                cursor.execute(sql)
+        reconcile()
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        for name in (INGREDIENTS, RECIPE_INGREDIENTS, RECIPES, TAGS, USERS):
+            bump_version(name)
@@ -1,23 +1,212 @@
 import csv
+import io
+import json
+import re
+import sys
+import time
+from itertools import chain
+from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes.bulk import batched, insert_ignore
+from recipes.cache import INGREDIENTS, bump_version
 from recipes.models import Ingredient
 
+HEADER_UNITS = {'units', 'measurement_unit'}
+JSON_CHUNK_SIZE = 64 * 1024
+# Объект ингредиента много меньше; больший элемент считается ошибкой, а
+# не читается в память до конца файла.
+JSON_MAX_ITEM_SIZE = 1024 * 1024
+WHITESPACE = re.compile(r'\s*')
 
-def ingredient_create(row):
-    Ingredient.objects.get_or_create(
-        name=row[0],
-        units=row[1]
-    )
+
+def read_csv(file):
+    reader = csv.reader(file)
+    try:
+        for row in reader:
+            if not row:
+                continue
+            if reader.line_num == 1 and (
+                row[-1].strip().lower() in HEADER_UNITS
+            ):
+                continue
+            yield row[0], row[1] if len(row) > 1 else ''
+    except csv.Error as error:
+        raise CommandError(f'Invalid CSV, line {reader.line_num}: {error}')
+
+
+class JSONArrayItems:
+    """
+    Элементы JSON-массива по одному, без чтения файла целиком.
+
+    Файл читается блоками по JSON_CHUNK_SIZE, открывающая скобка
+    массива уже прочитана.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.decoder = json.JSONDecoder()
+        self.buffer, self.position, self.eof = '', 0, False
+
+    def read_more(self):
+        if self.eof:
+            raise ValueError('unexpected end of array')
+        if len(self.buffer) - self.position > JSON_MAX_ITEM_SIZE:
+            raise ValueError('array item is too large')
+        chunk = self.file.read(JSON_CHUNK_SIZE)
+        self.eof = not chunk
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+
+    def next_char(self):
+        while True:
+            self.position = WHITESPACE.match(
+                self.buffer, self.position
+            ).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            self.read_more()
+
+    def decode(self):
+        while True:
+            try:
+                item, end = self.decoder.raw_decode(
+                    self.buffer, self.position
+                )
+            except ValueError:
+                if self.eof:
+                    raise
+            else:
+                # Число в конце блока может продолжаться в следующем.
+                if end < len(self.buffer) or self.eof:
+                    self.position = end
+                    return item
+            self.read_more()
+
+    def __iter__(self):
+        # Ожидается: first - элемент или ], value - элемент,
+        # separator - запятая или ].
+        expect = 'first'
+        while True:
+            char = self.next_char()
+            if char == ']' and expect != 'value':
+                break
+            if expect == 'separator':
+                if char != ',':
+                    raise ValueError('"," or "]" expected after array item')
+                self.position += 1
+                expect = 'value'
+                continue
+            yield self.decode()
+            expect = 'separator'
+        self.position += 1
+        rest = self.buffer[self.position:] + self.file.read(JSON_CHUNK_SIZE)
+        if rest.strip():
+            raise ValueError('extra data after array')
+
+
+def read_json(file):
+    """Массив объектов или JSON Lines, по объекту в строке"""
+    first = file.read(1)
+    while first.isspace():
+        first = file.read(1)
+    try:
+        if first == '[':
+            items = JSONArrayItems(file)
+        else:
+            items = (
+                json.loads(line) for line in
+                chain([first + file.readline()], file) if line.strip()
+            )
+        for item in items:
+            if not isinstance(item, dict):
+                raise ValueError(f'object expected, got {item!r}')
+            yield (
+                item.get('name', ''),
+                item.get('units', item.get('measurement_unit', ''))
+            )
+    except ValueError as error:
+        raise CommandError(f'Invalid JSON: {error}')
+
+
+READERS = {'csv': read_csv, 'json': read_json}
 
 
 class Command(BaseCommand):
     help = 'Load ingredients to DB'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default='data/ingredients.csv',
+            help='CSV or JSON file with ingredients, "-" for stdin.'
+        )
+        parser.add_argument(
+            '--format',
+            choices=READERS,
+            help='Input format, by default taken from the file extension.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rows inserted per statement.'
+        )
+
+    def open(self, path):
+        if path == '-':
+            return io.TextIOWrapper(
+                sys.stdin.buffer, encoding='utf-8-sig', newline=''
+            )
+        try:
+            return open(path, encoding='utf-8-sig', newline='')
+        except OSError as error:
+            raise CommandError(error)
+
+    def rows(self, file, reader):
+        max_length = Ingredient._meta.get_field('name').max_length
+        for name, units in reader(file):
+            name, units = str(name).strip(), str(units).strip()
+            if all(0 < len(value) <= max_length for value in (name, units)):
+                yield name, units
+                continue
+            self.skipped += 1
+            if self.skipped <= 10:
+                self.stderr.write(f'Skipped invalid row: {name!r}, {units!r}')
+
     def handle(self, *args, **options):
-        with open('data/ingredients.csv', 'r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            next(reader)
-            for row in reader:
-                ingredient_create(row)
+        path = options['path']
+        file_format = options['format'] or (
+            'json' if Path(path).suffix in ('.json', '.jsonl') else 'csv'
+        )
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+        self.skipped = 0
+        processed = 0
+        started = time.monotonic()
+        with self.open(path) as file, transaction.atomic():
+            count_before = Ingredient.objects.count()
+            rows = self.rows(file, READERS[file_format])
+            for batch in batched(rows, options['batch_size']):
+                # Повторы внутри пачки отбрасываются до вставки.
+                batch = list(dict.fromkeys(batch))
+                insert_ignore(Ingredient, ('name', 'units'), batch)
+                processed += len(batch)
+                if options['verbosity'] > 0:
+                    elapsed = time.monotonic() - started
+                    self.stdout.write(
+                        f'{processed} rows, '
+                        f'{processed / max(elapsed, 1e-6):.0f} rows/s'
+                    )
+            created = Ingredient.objects.count() - count_before
+        elapsed = time.monotonic() - started
+        if created:
+            bump_version(INGREDIENTS)
+        self.stdout.write(
+            f'{processed} rows processed, {created} created, '
+            f'{self.skipped} skipped in {elapsed:.2f}s '
+            f'({processed / max(elapsed, 1e-6):.0f} rows/s).'
+        )
         self.stdout.write('The ingredients has been loaded successfully.')
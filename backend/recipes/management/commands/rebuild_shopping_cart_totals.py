@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import ShoppingCartIngredient
+from recipes.shopping_cart import expected_totals
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or verify shopping cart ingredient totals'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only report drift, exit with an error if any is found.'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            expected = expected_totals()
+            actual = {
+                (user_id, ingredient_id): total
+                for user_id, ingredient_id, total in (
+                    ShoppingCartIngredient.objects
+                    .select_for_update()
+                    .values_list('user_id', 'ingredient_id', 'total_amount')
+                    .iterator()
+                )
+            }
+            drift = {
+                key for key in expected.keys() | actual.keys()
+                if expected.get(key) != actual.get(key)
+            }
+            self.stdout.write(
+                f'{len(expected)} totals expected, {len(drift)} drifted.'
+            )
+            if options['verify']:
+                if drift:
+                    raise CommandError('Shopping cart totals have drifted.')
+                return
+            ShoppingCartIngredient.objects.all().delete()
+            ShoppingCartIngredient.objects.bulk_create(
+                (
+                    ShoppingCartIngredient(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        total_amount=total
+                    )
+                    for (user_id, ingredient_id), total in expected.items()
+                ),
+                batch_size=1000
+            )
+        self.stdout.write('The shopping cart totals have been rebuilt.')
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Reconcile denormalized favorites, cart and follower counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only report drift, exit with an error if any is found.'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            drift = reconcile(verify=options['verify'])
+        for counter, drifted in drift.items():
+            self.stdout.write(f'{counter}: {drifted} drifted.')
+        if options['verify'] and any(drift.values()):
+            raise CommandError('Counters have drifted.')
+        if not options['verify']:
+            self.stdout.write('The counters have been reconciled.')
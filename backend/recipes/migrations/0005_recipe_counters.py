@@ -0,0 +1,57 @@
+# Generated by Django 3.2.19 on 2026-10-17 04:25
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count_related(model, field):
+    return Coalesce(
+        models.Subquery(
+            model.objects
+            .filter(**{field: models.OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(count=models.Count('pk'))
+            .values('count'),
+            output_field=models.IntegerField()
+        ),
+        0
+    )
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favorite = apps.get_model('recipes', 'Favorite')
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    User = apps.get_model('users', 'User')
+    Subscribe = apps.get_model('users', 'Subscribe')
+    Recipe.objects.update(
+        favorites_count=count_related(Favorite, 'recipe'),
+        in_carts_count=count_related(ShoppingCart, 'recipe')
+    )
+    User.objects.update(
+        recipes_count=count_related(Recipe, 'author'),
+        followers_count=count_related(Subscribe, 'author')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_shoppingcartingredient'),
+        ('users', '0002_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В корзинах'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.19 on 2026-10-17 09:12
+
+from django.db import migrations
+
+from recipes.search import install_recipe_search, uninstall_recipe_search
+
+
+def install(apps, schema_editor):
+    install_recipe_search(schema_editor.connection)
+
+
+def uninstall(apps, schema_editor):
+    uninstall_recipe_search(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_image_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
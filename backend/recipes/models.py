@@ -1,7 +1,9 @@
 from django.core.validators import MinValueValidator, RegexValidator
 from django.db import models
+from django.db.models import Exists, OuterRef, Prefetch, Value
 
-from users.models import User
+from users.models import CountersModel, User
+from .storage import ContentAddressedStorage
 
 
 class Tag(models.Model):
@@ -49,7 +51,50 @@ class Ingredient(models.Model):
         return f'{self.name}, {self.units}'
 
 
-class Recipe(models.Model):
+def recipe_prefetch_lookups():
+    """Связанные с рецептом данные, которые отдаются вместе с ним"""
+    return (
+        'tags',
+        Prefetch(
+            'ingredient_amount',
+            queryset=RecipeIngredient.objects.select_related('ingredient')
+        )
+    )
+
+
+class RecipeQuerySet(models.QuerySet):
+    """Выборка рецептов"""
+
+    def with_related(self):
+        """Автор, теги и ингредиенты за фиксированное число запросов"""
+        return self.select_related('author').prefetch_related(
+            *recipe_prefetch_lookups()
+        )
+
+    def for_read(self, user):
+        """Выборка для отдачи рецептов пользователю"""
+        return self.with_related().with_user_flags(user)
+
+    def with_user_flags(self, user):
+        """Отметки «в избранном» и «в корзине» для пользователя"""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False, output_field=models.BooleanField()),
+                is_in_shopping_cart=Value(
+                    False, output_field=models.BooleanField()
+                )
+            )
+        return self.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            ))
+        )
+
+
+class Recipe(CountersModel):
     """Модель рецептов"""
 
     author = models.ForeignKey(
@@ -64,6 +109,7 @@ class Recipe(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='recipes/images',
+        storage=ContentAddressedStorage(),
         blank=True
     )
 
@@ -92,10 +138,47 @@ class Recipe(models.Model):
         verbose_name='Дата публикации'
     )
 
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения'
+    )
+
+    favorites_count = models.PositiveIntegerField(
+        'В избранном',
+        default=0,
+        editable=False
+    )
+
+    in_carts_count = models.PositiveIntegerField(
+        'В корзинах',
+        default=0,
+        editable=False
+    )
+
+    image_variants = models.JSONField(
+        'Варианты картинки',
+        default=dict,
+        editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
+
+    COUNTER_FIELDS = ('favorites_count', 'in_carts_count')
+
     class Meta:
-        ordering = ['-pub_date']
+        ordering = ['-pub_date', '-id']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='recipe_author_pub_date_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -124,7 +207,6 @@ class RecipeIngredient(models.Model):
     )
 
     class Meta:
-        ordering = ['recipe__name']
         verbose_name = 'Ингредиент рецепта'
         verbose_name_plural = 'Ингредиент рецептов'
         constraints = [
@@ -198,3 +280,36 @@ class Favorite(models.Model):
 
     def __str__(self):
         return f'{self.user.username} - {self.recipe.name}'
+
+
+class ShoppingCartIngredient(models.Model):
+    """Итоговое количество ингредиента в корзине пользователя"""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_ingredients',
+        verbose_name='Пользователь'
+    )
+
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_ingredients',
+        verbose_name='Ингредиент'
+    )
+
+    total_amount = models.IntegerField('Количество')
+
+    class Meta:
+        verbose_name = 'Ингредиент корзины'
+        verbose_name_plural = 'Ингредиенты корзины'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_cart_ingredient'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} - {self.ingredient} в кол-ве {self.total_amount}'
@@ -0,0 +1,426 @@
+import math
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.db import connections
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+
+from .cache import INGREDIENTS, RECIPE_INGREDIENTS, get_version
+from .models import Ingredient, Recipe, RecipeIngredient
+
+
+def normalize(value):
+    """Приведение строки к виду для поиска: регистр и ё/е не важны"""
+    return value.strip().lower().replace('ё', 'е')
+
+
+class IngredientIndex:
+    """
+    Префиксный индекс названий ингредиентов в памяти процесса.
+
+    Индекс перестраивается, когда меняется версия в кеше (ее поднимают
+    сигналы при сохранении и удалении ингредиентов) или истекает
+    INGREDIENT_INDEX_TTL, поэтому поиск не обращается к БД.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._built_at = 0
+        # (нормализованные названия, ингредиенты) - заменяется целиком,
+        # чтобы читатели не видели ключи одной сборки с данными другой.
+        self._state = ((), ())
+
+    def _is_stale(self, version):
+        return (
+            version != self._version
+            or time.monotonic() - self._built_at
+            > settings.INGREDIENT_INDEX_TTL
+        )
+
+    def _refresh(self):
+        version = get_version(INGREDIENTS)
+        if not self._is_stale(version):
+            return
+        with self._lock:
+            if not self._is_stale(version):
+                return
+            rows = sorted(
+                (
+                    (normalize(name), {'id': pk, 'name': name, 'units': units})
+                    for pk, name, units in Ingredient.objects.values_list(
+                        'id', 'name', 'units'
+                    )
+                ),
+                key=lambda row: (row[0], row[1]['id'])
+            )
+            self._state = (
+                tuple(key for key, _ in rows),
+                tuple(item for _, item in rows)
+            )
+            self._version = version
+            self._built_at = time.monotonic()
+
+    def all(self):
+        self._refresh()
+        return list(self._state[1])
+
+    def search(self, query, limit=None):
+        """
+        Ингредиенты, название которых начинается с query, затем те,
+        в названии которых query встречается, не более limit штук.
+        """
+        self._refresh()
+        if limit is None:
+            limit = settings.INGREDIENT_SEARCH_LIMIT
+        query = normalize(query)
+        keys, items = self._state
+        if not query:
+            return list(items[:limit])
+        result = []
+        start = bisect_left(keys, query)
+        for position in range(start, len(keys)):
+            if len(result) >= limit or not keys[position].startswith(query):
+                break
+            result.append(items[position])
+        for key, item in zip(keys, items):
+            if len(result) >= limit:
+                break
+            if query in key and not key.startswith(query):
+                result.append(item)
+        return result
+
+
+ingredient_index = IngredientIndex()
+
+# Поля в порядке сортировки: доля совпадений, число совпадений, новизна.
+RecipeMatch = namedtuple(
+    'RecipeMatch', ('coverage', 'matched', 'recipe_id', 'total')
+)
+
+
+class RecipeMatchIndex:
+    """
+    Обратный индекс «ингредиент -> рецепты» в памяти процесса.
+
+    Рецепты ингредиента разложены по числу ингредиентов в рецепте: так
+    для частых ингредиентов (соль, сахар) можно не перебирать рецепты,
+    которые заведомо не наберут нужную долю совпадений.
+
+    Когда меняется версия состава рецептов, в индекс подгружаются только
+    рецепты, сохраненные после прошлого обновления (изменение строк
+    состава тоже сдвигает updated_at рецепта). Удаленные рецепты
+    убирает discard, а полностью индекс перестраивается раз в
+    RECIPE_MATCH_INDEX_TTL.
+    """
+    # Запас на транзакции, которые сохранили рецепт до прошлого
+    # обновления индекса, а закоммитили после.
+    SYNC_OVERLAP = timedelta(minutes=1)
+    # Ингредиент считается частым, если он есть в такой доле рецептов.
+    COMMON_SHARE = 0.01
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._built_at = None
+        self._synced_at = None
+        # Индекс заменяется целиком, чтобы читатели не видели его
+        # посреди обновления: (ingredient_id -> {размер рецепта: рецепты},
+        # ingredient_id -> число рецептов, recipe_id -> ингредиенты).
+        self._state = ({}, {}, {})
+
+    @staticmethod
+    def _compositions(recipe_ids=None):
+        lines = RecipeIngredient.objects.all()
+        if recipe_ids is not None:
+            lines = lines.filter(recipe_id__in=recipe_ids)
+        compositions = {}
+        for recipe_id, ingredient_id in lines.values_list(
+            'recipe_id', 'ingredient_id'
+        ).iterator():
+            compositions.setdefault(recipe_id, set()).add(ingredient_id)
+        return compositions
+
+    def _replace(self, compositions, recipe_ids):
+        """Новое состояние, где у рецептов recipe_ids состав compositions"""
+        postings, counts, recipes = self._state
+        postings, counts, recipes = dict(postings), dict(counts), dict(recipes)
+        copied = set()
+
+        def bucket(ingredient_id, total):
+            if ingredient_id not in copied:
+                postings[ingredient_id] = dict(postings.get(ingredient_id, {}))
+                copied.add(ingredient_id)
+            buckets = postings[ingredient_id]
+            if (ingredient_id, total) not in copied:
+                buckets[total] = set(buckets.get(total, ()))
+                copied.add((ingredient_id, total))
+            return buckets[total]
+
+        for recipe_id in recipe_ids:
+            old = recipes.pop(recipe_id, frozenset())
+            new = frozenset(compositions.get(recipe_id, ()))
+            for ingredient_id in old:
+                bucket(ingredient_id, len(old)).discard(recipe_id)
+                counts[ingredient_id] -= 1
+            for ingredient_id in new:
+                bucket(ingredient_id, len(new)).add(recipe_id)
+                counts[ingredient_id] = counts.get(ingredient_id, 0) + 1
+            if new:
+                recipes[recipe_id] = new
+        self._state = (postings, counts, recipes)
+
+    def _is_expired(self):
+        return (
+            self._built_at is None
+            or time.monotonic() - self._built_at
+            > settings.RECIPE_MATCH_INDEX_TTL
+        )
+
+    def _refresh(self):
+        version = get_version(RECIPE_INGREDIENTS)
+        if version == self._version and not self._is_expired():
+            return
+        with self._lock:
+            rebuild = self._is_expired()
+            if version == self._version and not rebuild:
+                return
+            synced_at = timezone.now()
+            if rebuild:
+                self._state = ({}, {}, {})
+                compositions = self._compositions()
+                self._replace(compositions, compositions)
+                self._built_at = time.monotonic()
+            else:
+                changed = list(Recipe.objects.filter(
+                    updated_at__gte=self._synced_at - self.SYNC_OVERLAP
+                ).values_list('id', flat=True))
+                self._replace(self._compositions(changed), changed)
+            self._synced_at = synced_at
+            self._version = version
+
+    def discard(self, recipe_ids):
+        """Убрать из индекса рецепты, которых больше нет"""
+        with self._lock:
+            self._replace({}, list(recipe_ids))
+
+    @staticmethod
+    def _count_common(state, matched, common, min_coverage):
+        """Добавить к matched совпадения по частым ингредиентам common"""
+        postings, _, recipes = state
+        for recipe_id in matched:
+            total = len(recipes[recipe_id])
+            matched[recipe_id] += sum(
+                recipe_id in postings[pk].get(total, ()) for pk in common
+            )
+        # Рецепт, совпавший только по частым ингредиентам, проходит порог,
+        # лишь если в нем не больше len(common) / min_coverage ингредиентов.
+        max_total = len(common) / min_coverage if min_coverage else math.inf
+        only_common = Counter()
+        for ingredient_id in common:
+            for total, bucket in postings[ingredient_id].items():
+                if total <= max_total:
+                    only_common.update(bucket)
+        for recipe_id, count in only_common.items():
+            matched.setdefault(recipe_id, count)
+
+    def match(self, ingredient_ids, min_coverage):
+        """
+        Рецепты, в которых из ingredient_ids есть не меньше min_coverage
+        доли ингредиентов, от самого полного совпадения.
+        """
+        self._refresh()
+        state = self._state
+        postings, counts, recipes = state
+        ingredient_ids = {pk for pk in ingredient_ids if pk in postings}
+        common_count = len(recipes) * self.COMMON_SHARE
+        common = [pk for pk in ingredient_ids if counts[pk] > common_count]
+        matched = Counter()
+        for ingredient_id in ingredient_ids.difference(common):
+            for bucket in postings[ingredient_id].values():
+                matched.update(bucket)
+        if common:
+            self._count_common(state, matched, common, min_coverage)
+        ranked = []
+        for recipe_id, count in matched.items():
+            total = len(recipes[recipe_id])
+            if count >= min_coverage * total:
+                ranked.append(
+                    RecipeMatch(count / total, count, recipe_id, total)
+                )
+        ranked.sort(reverse=True)
+        return ranked
+
+
+recipe_match_index = RecipeMatchIndex()
+
+
+# Полнотекстовый поиск рецептов по названию и описанию живет вне модели:
+# на PostgreSQL это колонка tsvector с GIN-индексом, на SQLite - таблица
+# FTS5. И ту и другую поддерживают триггеры, так что поиск видит любые
+# изменения рецептов, в том числе сделанные через bulk_create и update().
+# Буква ё заменяется на е и в документах, и в запросах.
+POSTGRES_SEARCH_SQL = (
+    'ALTER TABLE recipes_recipe '
+    'ADD COLUMN IF NOT EXISTS search_vector tsvector',
+    """
+    CREATE OR REPLACE FUNCTION recipes_recipe_search_vector()
+    RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector(
+                'russian', translate(coalesce(NEW.name, ''), 'ёЁ', 'еЕ')
+            ), 'A')
+            || setweight(to_tsvector(
+                'russian', translate(coalesce(NEW.text, ''), 'ёЁ', 'еЕ')
+            ), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    'DROP TRIGGER IF EXISTS recipes_recipe_search_vector ON recipes_recipe',
+    """
+    CREATE TRIGGER recipes_recipe_search_vector
+    BEFORE INSERT OR UPDATE OF name, text ON recipes_recipe
+    FOR EACH ROW EXECUTE PROCEDURE recipes_recipe_search_vector()
+    """,
+    'UPDATE recipes_recipe SET name = name WHERE search_vector IS NULL',
+    'CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector_gin '
+    'ON recipes_recipe USING gin (search_vector)',
+)
+POSTGRES_DROP_SEARCH_SQL = (
+    'DROP TRIGGER IF EXISTS recipes_recipe_search_vector ON recipes_recipe',
+    'DROP FUNCTION IF EXISTS recipes_recipe_search_vector()',
+    'ALTER TABLE recipes_recipe DROP COLUMN IF EXISTS search_vector',
+)
+SQLITE_SEARCH_TRIGGERS = {
+    'recipes_recipe_fts_insert': """
+        CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_insert
+        AFTER INSERT ON recipes_recipe BEGIN
+            INSERT INTO recipes_recipe_fts (rowid, name, text) VALUES (
+                new.id,
+                replace(replace(new.name, 'ё', 'е'), 'Ё', 'Е'),
+                replace(replace(new.text, 'ё', 'е'), 'Ё', 'Е')
+            );
+        END
+    """,
+    'recipes_recipe_fts_delete': """
+        CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_delete
+        AFTER DELETE ON recipes_recipe BEGIN
+            DELETE FROM recipes_recipe_fts WHERE rowid = old.id;
+        END
+    """,
+    'recipes_recipe_fts_update': """
+        CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_update
+        AFTER UPDATE OF name, text ON recipes_recipe BEGIN
+            UPDATE recipes_recipe_fts SET
+                name = replace(replace(new.name, 'ё', 'е'), 'Ё', 'Е'),
+                text = replace(replace(new.text, 'ё', 'е'), 'Ё', 'Е')
+            WHERE rowid = new.id;
+        END
+    """,
+}
+SQLITE_SEARCH_SQL = (
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS recipes_recipe_fts
+    USING fts5(name, text, tokenize='unicode61 remove_diacritics 2')
+    """,
+    'DELETE FROM recipes_recipe_fts',
+    """
+    INSERT INTO recipes_recipe_fts (rowid, name, text)
+    SELECT
+        id,
+        replace(replace(name, 'ё', 'е'), 'Ё', 'Е'),
+        replace(replace(text, 'ё', 'е'), 'Ё', 'Е')
+    FROM recipes_recipe
+    """,
+)
+SEARCH_TERM = re.compile(r'\w+')
+SEARCH_MIGRATION = '0008_recipe_search'
+
+
+def install_recipe_search(connection):
+    """
+    Создать колонку или таблицу поиска и триггеры, если их нет.
+
+    На SQLite триггеры пропадают, когда миграция пересоздает таблицу
+    рецептов, поэтому функция вызывается и после каждого migrate.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for sql in POSTGRES_SEARCH_SQL:
+                cursor.execute(sql)
+        elif connection.vendor == 'sqlite':
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' "
+                "AND tbl_name = 'recipes_recipe'"
+            )
+            existing = {name for name, in cursor.fetchall()}
+            if existing.issuperset(SQLITE_SEARCH_TRIGGERS):
+                return
+            for sql in (*SQLITE_SEARCH_SQL, *SQLITE_SEARCH_TRIGGERS.values()):
+                cursor.execute(sql)
+
+
+def uninstall_recipe_search(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for sql in POSTGRES_DROP_SEARCH_SQL:
+                cursor.execute(sql)
+        elif connection.vendor == 'sqlite':
+            for name in SQLITE_SEARCH_TRIGGERS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+            cursor.execute('DROP TABLE IF EXISTS recipes_recipe_fts')
+
+
+def search_recipes(queryset, query):
+    """
+    Рецепты из queryset, подходящие под query, от более релевантных.
+
+    На PostgreSQL используются русская морфология и ts_rank по колонке
+    search_vector, где название весит больше описания. На SQLite поиск
+    идет по префиксам слов в FTS5 и ранжируется через bm25.
+    """
+    if connections[queryset.db].vendor == 'postgresql':
+        from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                                    SearchVectorField)
+
+        search_query = SearchQuery(
+            normalize(query), config='russian', search_type='websearch'
+        )
+        queryset = queryset.alias(
+            search_vector=RawSQL(
+                'recipes_recipe.search_vector', (),
+                output_field=SearchVectorField()
+            )
+        ).filter(search_vector=search_query).alias(
+            search_rank=SearchRank(F('search_vector'), search_query)
+        )
+    else:
+        terms = SEARCH_TERM.findall(normalize(query))
+        if not terms:
+            return queryset.none()
+        match = ' '.join(f'"{term}"*' for term in terms)
+        queryset = queryset.filter(
+            id__in=RawSQL(
+                'SELECT rowid FROM recipes_recipe_fts '
+                'WHERE recipes_recipe_fts MATCH %s',
+                (match,)
+            )
+        ).alias(
+            search_rank=RawSQL(
+                'SELECT -bm25(recipes_recipe_fts, 10.0, 1.0) '
+                'FROM recipes_recipe_fts '
+                'WHERE recipes_recipe_fts MATCH %s '
+                'AND recipes_recipe_fts.rowid = recipes_recipe.id',
+                (match,)
+            )
+        )
+    return queryset.order_by('-search_rank', '-pub_date', '-id')
@@ -0,0 +1,102 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+
+from users.models import User
+from .models import RecipeIngredient, ShoppingCart, ShoppingCartIngredient
+
+
+def recipe_amounts(recipe_id):
+    """Количество каждого ингредиента рецепта: {ingredient_id: amount}"""
+    return dict(
+        RecipeIngredient.objects
+        .filter(recipe_id=recipe_id)
+        .values_list('ingredient_id', 'amount')
+    )
+
+
+def apply_deltas(user_ids, deltas):
+    """
+    Изменить итоги корзин пользователей на deltas {ingredient_id: delta}.
+
+    Строки пользователей блокируются, чтобы параллельные изменения одной
+    корзины не теряли обновления; строки с нулевым итогом удаляются.
+    """
+    deltas = {
+        ingredient_id: delta
+        for ingredient_id, delta in deltas.items() if delta
+    }
+    user_ids = sorted(set(user_ids))
+    if not deltas or not user_ids:
+        return
+    with transaction.atomic():
+        list(
+            User.objects.select_for_update()
+            .filter(pk__in=user_ids).order_by('pk').values_list('pk')
+        )
+        totals = ShoppingCartIngredient.objects.filter(
+            user_id__in=user_ids, ingredient_id__in=deltas
+        )
+        existing = set(totals.values_list('user_id', 'ingredient_id'))
+        # Одним UPDATE на все ингредиенты, а не запросом на каждый.
+        totals.update(total_amount=F('total_amount') + Case(
+            *(
+                When(ingredient_id=ingredient_id, then=Value(delta))
+                for ingredient_id, delta in deltas.items()
+            ),
+            output_field=IntegerField()
+        ))
+        ShoppingCartIngredient.objects.bulk_create([
+            ShoppingCartIngredient(
+                user_id=user_id,
+                ingredient_id=ingredient_id,
+                total_amount=delta
+            )
+            for user_id in user_ids
+            for ingredient_id, delta in deltas.items()
+            if delta > 0 and (user_id, ingredient_id) not in existing
+        ])
+        totals.filter(total_amount__lte=0).delete()
+
+
+def add_recipe(user_id, recipe_id):
+    apply_deltas([user_id], recipe_amounts(recipe_id))
+
+
+def remove_recipe(user_id, recipe_id):
+    apply_deltas([user_id], {
+        ingredient_id: -amount
+        for ingredient_id, amount in recipe_amounts(recipe_id).items()
+    })
+
+
+def change_recipe(recipe_id, old_amounts, new_amounts):
+    """Пересчитать корзины, в которых лежит рецепт с измененным составом"""
+    deltas = Counter(new_amounts)
+    deltas.subtract(old_amounts)
+    apply_deltas(
+        ShoppingCart.objects
+        .filter(recipe_id=recipe_id)
+        .values_list('user_id', flat=True),
+        deltas
+    )
+
+
+def expected_totals():
+    """Итоги корзин, посчитанные заново по рецептам"""
+    return {
+        (user_id, ingredient_id): total
+        for user_id, ingredient_id, total in (
+            RecipeIngredient.objects
+            .filter(recipe__shopping_cart__isnull=False)
+            .values(
+                'recipe__shopping_cart__user_id', 'ingredient_id'
+            )
+            .annotate(total=Sum('amount'))
+            .values_list(
+                'recipe__shopping_cart__user_id', 'ingredient_id', 'total'
+            )
+            .iterator()
+        )
+    }
@@ -0,0 +1,159 @@
+from django.db import connections, transaction
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models.signals import (m2m_changed, post_delete,
+                                      post_migrate, post_save, pre_delete)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from users.models import Subscribe, User
+from .cache import (INGREDIENTS, RECIPE_INGREDIENTS, RECIPES, TAGS, USERS,
+                    bump_version, recipe_version_name, user_version_name,
+                    viewer_version_name)
+from . import counters, images, search, shopping_cart
+from .models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                     ShoppingCart, Tag)
+
+
+def bump_on_commit(name):
+    transaction.on_commit(lambda: bump_version(name))
+
+
+def touch_recipes(recipe_ids):
+    Recipe.objects.filter(pk__in=recipe_ids).update(updated_at=timezone.now())
+
+
+def touch_on_commit(recipe_id):
+    """
+    Сдвинуть updated_at рецепта после фиксации транзакции.
+
+    Рецепты одной транзакции обновляются одним UPDATE, сколько бы строк
+    их состава ни изменилось.
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        touch_recipes([recipe_id])
+        return
+    # Django заменяет список run_on_commit при фиксации и откатах: пока
+    # список и точки сохранения те же, запланированный UPDATE еще не
+    # выполнен и не отменен.
+    queue = connection.run_on_commit
+    savepoints = [sid for sid in connection.savepoint_ids if sid is not None]
+    pending = getattr(connection, 'touched_recipes', None)
+    if pending is not None:
+        pending_queue, pending_savepoints, recipe_ids = pending
+        if pending_queue is queue and pending_savepoints == savepoints:
+            recipe_ids.add(recipe_id)
+            return
+    recipe_ids = {recipe_id}
+    connection.touched_recipes = (queue, savepoints, recipe_ids)
+
+    def flush():
+        current = getattr(connection, 'touched_recipes', None)
+        if current is not None and current[2] is recipe_ids:
+            connection.touched_recipes = None
+        touch_recipes(recipe_ids)
+
+    transaction.on_commit(flush)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredient_changed(**kwargs):
+    bump_on_commit(INGREDIENTS)
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tag_changed(**kwargs):
+    bump_on_commit(TAGS)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_changed(instance, **kwargs):
+    bump_on_commit(recipe_version_name(instance.pk))
+    bump_on_commit(RECIPE_INGREDIENTS)
+    bump_on_commit(RECIPES)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_changed(instance, **kwargs):
+    if (
+        instance.image
+        and instance.image_variants.get('source') != instance.image.name
+    ):
+        images.schedule_variants(instance)
+
+
+@receiver(post_migrate)
+def recipe_search_installed(sender, using, plan=None, **kwargs):
+    # Пересоздание таблицы рецептов на SQLite удаляет триггеры поиска.
+    if sender.name != 'recipes' or not plan:
+        return
+    connection = connections[using]
+    applied = MigrationRecorder(connection).applied_migrations()
+    if ('recipes', search.SEARCH_MIGRATION) in applied:
+        search.install_recipe_search(connection)
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def recipe_ingredient_changed(instance, **kwargs):
+    # Индекс совпадений подгружает рецепты по updated_at; рецепт
+    # сдвигается до подъема версии, чтобы обновление индекса его увидело.
+    touch_on_commit(instance.recipe_id)
+    bump_on_commit(recipe_version_name(instance.recipe_id))
+    bump_on_commit(RECIPE_INGREDIENTS)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        bump_on_commit(recipe_version_name(instance.pk))
+    elif pk_set:
+        for recipe_id in pk_set:
+            bump_on_commit(recipe_version_name(recipe_id))
+    else:
+        bump_on_commit(TAGS)
+
+
+@receiver(post_save, sender=User)
+def user_changed(instance, created, update_fields, **kwargs):
+    # Нового пользователя еще нет в чужих ответах, а вход, смена пароля и
+    # счетчики не меняют полей, которые видят другие пользователи.
+    changed = not created and instance.public_fields_changed(update_fields)
+    instance.remember_public_fields()
+    if changed:
+        bump_on_commit(user_version_name(instance.pk))
+        bump_on_commit(USERS)
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+@receiver((post_save, post_delete), sender=Subscribe)
+def viewer_state_changed(instance, **kwargs):
+    bump_on_commit(viewer_version_name(instance.user_id))
+
+
+@receiver(post_save, sender=ShoppingCart)
+def shopping_cart_added(instance, created, **kwargs):
+    if created:
+        shopping_cart.add_recipe(instance.user_id, instance.recipe_id)
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def shopping_cart_removed(instance, **kwargs):
+    # До удаления: при удалении рецепта его ингредиенты еще на месте.
+    shopping_cart.remove_recipe(instance.user_id, instance.recipe_id)
+
+
+def counted_created(sender, instance, created, **kwargs):
+    if created:
+        counters.related_changed(sender, instance, 1)
+
+
+def counted_deleted(sender, instance, **kwargs):
+    counters.related_changed(sender, instance, -1)
+
+
+for counted_model in counters.COUNTED_MODELS:
+    post_save.connect(counted_created, sender=counted_model)
+    post_delete.connect(counted_deleted, sender=counted_model)
@@ -0,0 +1,36 @@
+import hashlib
+import os
+import posixpath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранилище, которое называет файлы по SHA-256 их содержимого.
+
+    Файл кладется в <каталог>/<2 символа хеша>/<хеш><расширение>; если
+    такой файл уже есть, запись пропускается. Содержимое файла по имени
+    никогда не меняется, поэтому его можно кешировать навсегда.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        name = posixpath.join(
+            posixpath.dirname(name), digest[:2], digest + extension
+        )
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
@@ -0,0 +1,196 @@
+import random
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+
+from users.models import Subscribe, User
+from .bulk import insert_rows
+from .models import (Favorite, Recipe, RecipeIngredient, ShoppingCart,
+                     ShoppingCartIngredient)
+
+# Строки генерируются блоками со своим генератором случайных чисел:
+# данные зависят только от зерна, а не от числа процессов.
+CHUNK_SIZE = 10000
+# Простое число: умножение на него по модулю размера выборки меньше его
+# переставляет ранги, и популярные авторы и рецепты не идут подряд.
+SCATTER = 2654435761
+# Число действий пользователя распределено по Парето: у большинства
+# пользователей их мало, у немногих - очень много.
+ACTIVITY_SHAPE = 1.5
+ACTIVITY_MEAN = ACTIVITY_SHAPE / (ACTIVITY_SHAPE - 1)
+MAX_ACTIVITY = 1000
+START = datetime(2021, 1, 1, tzinfo=timezone.utc)
+SPAN = timedelta(days=3 * 365)
+
+FIRST_NAMES = ('Анна', 'Иван', 'Мария', 'Олег', 'Ольга', 'Петр', 'Юлия')
+LAST_NAMES = ('Иванов', 'Кузнецов', 'Орлов', 'Петров', 'Смирнов', 'Соколов')
+DISHES = (
+    'борщ', 'блины', 'гуляш', 'жаркое', 'запеканка', 'каша', 'котлеты',
+    'оладьи', 'пирог', 'плов', 'рагу', 'салат', 'солянка', 'суп', 'щи',
+)
+STYLES = (
+    'домашний', 'быстрый', 'праздничный', 'постный', 'летний', 'сытный',
+    'бабушкин', 'острый', 'легкий', 'деревенский',
+)
+TEXTS = (
+    'Смешать ингредиенты, довести до кипения и варить на слабом огне.',
+    'Обжарить на сковороде до золотистой корочки и подать горячим.',
+    'Запекать в духовке при 180 градусах до готовности.',
+    'Нарезать, заправить и дать постоять полчаса перед подачей.',
+)
+
+USER_FIELDS = (
+    'id', 'password', 'is_superuser', 'username', 'first_name',
+    'last_name', 'email', 'is_staff', 'is_active', 'date_joined',
+    'recipes_count', 'followers_count',
+)
+RECIPE_FIELDS = (
+    'id', 'author', 'name', 'image', 'text', 'cooking_time', 'pub_date',
+    'updated_at', 'favorites_count', 'in_carts_count', 'image_variants',
+)
+
+# Параметры генерации: первые ключи и размеры новых пользователей и
+# рецептов, ключи ингредиентов и тегов, средние числа отметок
+# «в избранном», рецептов в корзине и подписок на пользователя.
+Plan = namedtuple('Plan', (
+    'seed', 'exponent', 'first_user', 'users', 'first_recipe', 'recipes',
+    'ingredients', 'tags', 'favorites', 'carts', 'subscriptions',
+))
+
+
+@lru_cache(maxsize=None)
+def zipf_weights(size, exponent):
+    """Накопленные веса закона Ципфа для рангов 0..size-1"""
+    return list(accumulate(
+        1 / rank ** exponent for rank in range(1, size + 1)
+    ))
+
+
+def zipf_choices(rng, size, exponent, count):
+    """До count различных рангов: малые ранги выпадают чаще"""
+    count = min(count, size)
+    ranks = rng.choices(
+        range(size), cum_weights=zipf_weights(size, exponent), k=count * 2
+    )
+    return [rank * SCATTER % size for rank in dict.fromkeys(ranks)][:count]
+
+
+def activity(rng, mean):
+    """Число действий пользователя со средним mean"""
+    value = mean * rng.paretovariate(ACTIVITY_SHAPE) / ACTIVITY_MEAN
+    return min(MAX_ACTIVITY, int(value + rng.random()))
+
+
+def chunk_random(plan, phase, start):
+    return random.Random(f'{plan.seed}:{phase}:{start}')
+
+
+def generate_users(plan, start, stop):
+    rng = chunk_random(plan, 'users', start)
+    password = make_password(None)
+    rows = []
+    for offset in range(start, stop):
+        pk = plan.first_user + offset
+        rows.append((
+            pk, password, False, f'synthetic{pk}', rng.choice(FIRST_NAMES),
+            rng.choice(LAST_NAMES), f'synthetic{pk}@example.com', False,
+            True, START + SPAN * offset / plan.users, 0, 0,
+        ))
+    with transaction.atomic():
+        insert_rows(User, USER_FIELDS, rows)
+    return len(rows)
+
+
+def generate_recipes(plan, start, stop):
+    """Рецепты с ингредиентами и тегами; у знаменитостей их больше"""
+    rng = chunk_random(plan, 'recipes', start)
+    recipes, lines, tags = [], [], []
+    for offset in range(start, stop):
+        pk = plan.first_recipe + offset
+        author = zipf_choices(rng, plan.users, plan.exponent, 1)[0]
+        published = START + SPAN * (offset + rng.random()) / plan.recipes
+        recipes.append((
+            pk, plan.first_user + author,
+            f'{rng.choice(STYLES).capitalize()} {rng.choice(DISHES)}',
+            '', rng.choice(TEXTS), rng.randint(5, 180), published,
+            published, 0, 0, {},
+        ))
+        for rank in zipf_choices(
+            rng, len(plan.ingredients), plan.exponent, rng.randint(3, 12)
+        ):
+            lines.append((pk, plan.ingredients[rank], rng.randint(1, 500)))
+        for rank in zipf_choices(
+            rng, len(plan.tags), plan.exponent, rng.randint(1, 3)
+        ):
+            tags.append((pk, plan.tags[rank]))
+    with transaction.atomic():
+        insert_rows(Recipe, RECIPE_FIELDS, recipes)
+        insert_rows(
+            RecipeIngredient, ('recipe', 'ingredient', 'amount'), lines
+        )
+        insert_rows(Recipe.tags.through, ('recipe', 'tag'), tags)
+    return len(recipes) + len(lines) + len(tags)
+
+
+def insert_cart_totals(first_user, last_user):
+    """Итоги корзин пользователей с ключами first_user..last_user"""
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(ShoppingCartIngredient._meta.db_table)} '
+            '(user_id, ingredient_id, total_amount) '
+            'SELECT cart.user_id, line.ingredient_id, SUM(line.amount) '
+            f'FROM {quote(ShoppingCart._meta.db_table)} cart '
+            f'JOIN {quote(RecipeIngredient._meta.db_table)} line '
+            'ON line.recipe_id = cart.recipe_id '
+            'WHERE cart.user_id BETWEEN %s AND %s '
+            'GROUP BY cart.user_id, line.ingredient_id',
+            [first_user, last_user]
+        )
+        return cursor.rowcount
+
+
+def generate_relations(plan, start, stop):
+    """
+    Избранное, корзины и подписки пользователей и итоги их корзин.
+
+    Популярные рецепты и авторы выбираются чаще остальных.
+    """
+    rng = chunk_random(plan, 'relations', start)
+    favorites, carts, subscriptions = [], [], []
+    for offset in range(start, stop):
+        user = plan.first_user + offset
+        for rows, mean in ((favorites, plan.favorites), (carts, plan.carts)):
+            rows.extend(
+                (user, plan.first_recipe + rank) for rank in zipf_choices(
+                    rng, plan.recipes, plan.exponent, activity(rng, mean)
+                )
+            )
+        subscriptions.extend(
+            (user, plan.first_user + rank) for rank in zipf_choices(
+                rng, plan.users, plan.exponent,
+                activity(rng, plan.subscriptions)
+            )
+            if plan.first_user + rank != user
+        )
+    with transaction.atomic():
+        insert_rows(Favorite, ('user', 'recipe'), favorites)
+        insert_rows(ShoppingCart, ('user', 'recipe'), carts)
+        insert_rows(Subscribe, ('user', 'author'), subscriptions)
+        totals = insert_cart_totals(
+            plan.first_user + start, plan.first_user + stop - 1
+        )
+    return len(favorites) + len(carts) + len(subscriptions) + totals
+
+
+# Этапы выполняются по порядку: строки этапа ссылаются на предыдущие.
+# Этап: (название, функция, поле Plan с числом строк-источников).
+PHASES = (
+    ('users', generate_users, 'users'),
+    ('recipes', generate_recipes, 'recipes'),
+    ('relations', generate_relations, 'users'),
+)
@@ -0,0 +1,379 @@
+import io
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Exists, OuterRef
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from users.models import Subscribe, User
+from . import images, shopping_cart
+from .cache import TAGS, get_version
+from .management.commands import load_data
+from .models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                     ShoppingCart, ShoppingCartIngredient)
+from .search import IngredientIndex, RecipeMatchIndex
+
+
+class VersionTests(TestCase):
+    """Версии наборов данных в кеше"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_version_expires_in_process_cache(self):
+        version = get_version(TAGS)
+        later = time.time() + settings.CACHE_VERSION_TTL + 1
+        with mock.patch('time.time', return_value=later):
+            self.assertGreater(get_version(TAGS), version)
+
+
+class IngredientIndexTests(TestCase):
+    """Префиксный индекс ингредиентов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('Мёд', 'мука', 'молоко', 'сахар медовый'):
+            Ingredient.objects.create(name=name, units='г')
+
+    def setUp(self):
+        cache.clear()
+        self.index = IngredientIndex()
+
+    def names(self, query):
+        return [item['name'] for item in self.index.search(query)]
+
+    def test_prefix_then_substring(self):
+        self.assertEqual(self.names('мед'), ['Мёд', 'сахар медовый'])
+        self.assertEqual(self.names('мо'), ['молоко'])
+
+    def test_refresh_on_version_change(self):
+        self.assertEqual(self.names('мо'), ['молоко'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='морковь', units='г')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.names('мо'), ['молоко', 'морковь'])
+        with self.assertNumQueries(0):
+            self.index.search('мо')
+
+
+class RecipeMatchIndexTests(TestCase):
+    """Подбор рецептов по ингредиентам"""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='p',
+            first_name='Автор', last_name='Тестовый'
+        )
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'ингредиент {number}', units='г')
+            for number in range(5)
+        ]
+        cls.recipes = [
+            Recipe.objects.create(
+                author=author, name=f'Рецепт {number}', text='Смешать.',
+                cooking_time=10
+            )
+            for number in range(2)
+        ]
+        for ingredient in cls.ingredients[:4]:
+            RecipeIngredient.objects.create(
+                recipe=cls.recipes[0], ingredient=ingredient, amount=10
+            )
+        RecipeIngredient.objects.create(
+            recipe=cls.recipes[1], ingredient=cls.ingredients[4], amount=10
+        )
+        # Рецепты сохранены давно: их не подхватит запас SYNC_OVERLAP.
+        Recipe.objects.update(
+            updated_at=timezone.now() - timedelta(days=1)
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.index = RecipeMatchIndex()
+
+    def matched(self, ingredients, min_coverage):
+        return [
+            match.recipe_id for match in self.index.match(
+                [ingredient.pk for ingredient in ingredients], min_coverage
+            )
+        ]
+
+    def test_zero_coverage_keeps_large_recipes(self):
+        # В рецепте ингредиентов больше, чем рецептов в индексе.
+        self.assertEqual(
+            self.matched(self.ingredients[:1], 0), [self.recipes[0].pk]
+        )
+
+    def test_recipe_ingredient_change(self):
+        self.assertEqual(self.matched(self.ingredients[4:], 0.5), [
+            self.recipes[1].pk
+        ])
+        with self.captureOnCommitCallbacks(execute=True):
+            RecipeIngredient.objects.create(
+                recipe=self.recipes[0], ingredient=self.ingredients[4],
+                amount=10
+            )
+        self.assertEqual(
+            set(self.matched(self.ingredients[4:], 0)),
+            {recipe.pk for recipe in self.recipes}
+        )
+
+    def test_recipe_touched_once_per_transaction(self):
+        with CaptureQueriesContext(connection) as queries, \
+                self.captureOnCommitCallbacks(execute=True):
+            RecipeIngredient.objects.filter(recipe=self.recipes[0]).delete()
+            RecipeIngredient.objects.create(
+                recipe=self.recipes[1], ingredient=self.ingredients[0],
+                amount=10
+            )
+        touches = [
+            query for query in queries.captured_queries
+            if query['sql'].startswith('UPDATE')
+            and 'recipes_recipe' in query['sql']
+        ]
+        self.assertEqual(len(touches), 1)
+        self.assertEqual(
+            self.matched(self.ingredients[:1], 0), [self.recipes[1].pk]
+        )
+
+
+class QueryPlanTests(TestCase):
+    """Частые запросы API читают свои индексы"""
+
+    def hot_queries(self):
+        """
+        (название, queryset, индексы, один из которых должен быть в плане).
+
+        SQLite хранит ограничения уникальности, объявленные при создании
+        таблицы, в индексах sqlite_autoindex_*.
+        """
+        tags = Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'), tag__in=[1, 2]
+        )
+        return (
+            ('recipe feed', Recipe.objects.all()[:10],
+             ('recipe_pub_date_id_idx',)),
+            ('author recipes', Recipe.objects.filter(author_id=1)[:10],
+             ('recipe_author_pub_date_idx',)),
+            ('tags filter', Recipe.objects.filter(Exists(tags))[:10],
+             ('recipes_recipe_tags_recipe_id',)),
+            ('ingredients prefetch',
+             RecipeIngredient.objects.filter(recipe_id__in=[1, 2])
+             .select_related('ingredient'),
+             ('unique_recipe_ingredient',
+              'recipes_recipeingredient_recipe_id')),
+            ('is favorited', Favorite.objects.filter(user_id=1, recipe_id=1),
+             ('unique_favorite', 'sqlite_autoindex_recipes_favorite')),
+            ('is in shopping cart',
+             ShoppingCart.objects.filter(user_id=1, recipe_id=1),
+             ('unique_shopping_cart',
+              'sqlite_autoindex_recipes_shoppingcart')),
+        )
+
+    def test_hot_queries_use_indexes(self):
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            self.skipTest(f'index names are not known for {connection.vendor}')
+        if connection.vendor == 'postgresql':
+            # На маленьких таблицах планировщик предпочитает
+            # последовательное чтение; проверяется, что индекс годится.
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        for title, queryset, indexes in self.hot_queries():
+            with self.subTest(title):
+                plan = queryset.explain()
+                self.assertTrue(
+                    any(index in plan for index in indexes),
+                    f'none of {", ".join(indexes)} used:\n{plan}'
+                )
+                if queryset.model is not Recipe:
+                    self.assertNotIn(
+                        connection.ops.quote_name('recipes_recipe'),
+                        str(queryset.query)
+                    )
+
+
+class LoadDataTests(TestCase):
+    """Загрузка ингредиентов из JSON-массива по частям"""
+
+    def test_json_array_in_chunks(self):
+        items = [
+            {'name': f'ингредиент {number}', 'measurement_unit': 'г'}
+            for number in range(50)
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'ingredients.json')
+            with open(path, 'w', encoding='utf-8') as file:
+                json.dump(items, file, ensure_ascii=False, indent=1)
+            with mock.patch.object(load_data, 'JSON_CHUNK_SIZE', 16):
+                call_command('load_data', path, stdout=io.StringIO())
+        self.assertEqual(
+            set(Ingredient.objects.values_list('name', flat=True)),
+            {item['name'] for item in items}
+        )
+
+
+class ImageVariantTests(TestCase):
+    """Варианты картинок рецептов"""
+
+    def test_extension_in_name(self):
+        self.assertNotEqual(
+            images.variant_name('recipes/images/foo.png', 'preview', 720),
+            images.variant_name('recipes/images/foo.jpg', 'preview', 720)
+        )
+
+    @override_settings(IMAGE_PROCESSING_WORKERS=2)
+    def test_synchronous_build_keeps_connection(self):
+        # Синхронный вызов, как из build_image_variants, не закрывает
+        # соединение вызывающего кода.
+        with mock.patch.object(connection, 'close') as close, \
+                self.assertLogs('recipes.images', 'ERROR'):
+            images.build_variants(1, 'recipes/images/missing.png')
+        close.assert_not_called()
+
+    def test_size_change_renames(self):
+        name = 'recipes/images/foo.png'
+        before = images.expected_variants(name)
+        with override_settings(RECIPE_IMAGE_VARIANTS={'thumbnail': 160}):
+            after = images.expected_variants(name)
+        self.assertNotEqual(before['thumbnail'], after['thumbnail'])
+
+    def test_quality_change_renames(self):
+        name = 'recipes/images/foo.png'
+        before = images.expected_variants(name)
+        with override_settings(IMAGE_WEBP_QUALITY=60):
+            after = images.expected_variants(name)
+        self.assertNotEqual(before['preview'], after['preview'])
+
+
+class CountersTests(TestCase):
+    """Сохранение устаревшего экземпляра не затирает счетчики"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='p',
+            first_name='Автор', last_name='Тестовый'
+        )
+        cls.reader = User.objects.create_user(
+            username='reader', email='reader@example.com', password='p',
+            first_name='Читатель', last_name='Тестовый'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='Смешать.', cooking_time=10
+        )
+
+    def test_stale_full_save(self):
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        author = User.objects.get(pk=self.author.pk)
+        Favorite.objects.create(user=self.reader, recipe=self.recipe)
+        ShoppingCart.objects.create(user=self.reader, recipe=self.recipe)
+        Subscribe.objects.create(user=self.reader, author=self.author)
+        recipe.name = 'Новое название'
+        recipe.save()
+        author.set_password('another')
+        author.save()
+        recipe.refresh_from_db()
+        author.refresh_from_db()
+        self.assertEqual(recipe.name, 'Новое название')
+        self.assertEqual(
+            (recipe.favorites_count, recipe.in_carts_count), (1, 1)
+        )
+        self.assertTrue(author.check_password('another'))
+        self.assertEqual(
+            (author.recipes_count, author.followers_count), (1, 1)
+        )
+
+    def test_explicit_update_fields(self):
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        recipe.favorites_count = 5
+        recipe.save(update_fields=['favorites_count'])
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 5)
+
+
+class ShoppingCartTotalsTests(TestCase):
+    """Итоги корзин меняются вместе с корзинами и составом рецептов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                username=f'user{number}', email=f'user{number}@example.com',
+                password='p', first_name='Имя', last_name='Фамилия'
+            )
+            for number in range(2)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'ингредиент {number}', units='г')
+            for number in range(6)
+        ]
+        cls.recipes = []
+        for number in range(2):
+            recipe = Recipe.objects.create(
+                author=cls.users[0], name=f'Рецепт {number}',
+                text='Смешать.', cooking_time=10
+            )
+            for ingredient in cls.ingredients[number:number + 3]:
+                RecipeIngredient.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=10
+                )
+            cls.recipes.append(recipe)
+
+    def assertTotalsConsistent(self):
+        actual = {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total in (
+                ShoppingCartIngredient.objects.values_list(
+                    'user_id', 'ingredient_id', 'total_amount'
+                )
+            )
+        }
+        self.assertEqual(actual, shopping_cart.expected_totals())
+
+    def test_add_and_remove(self):
+        for user in self.users:
+            for recipe in self.recipes:
+                ShoppingCart.objects.create(user=user, recipe=recipe)
+        self.assertTotalsConsistent()
+        self.assertEqual(
+            ShoppingCartIngredient.objects.get(
+                user=self.users[0], ingredient=self.ingredients[1]
+            ).total_amount,
+            20
+        )
+        ShoppingCart.objects.get(
+            user=self.users[0], recipe=self.recipes[0]
+        ).delete()
+        self.assertTotalsConsistent()
+
+    def test_change_recipe(self):
+        for user in self.users:
+            ShoppingCart.objects.create(user=user, recipe=self.recipes[0])
+        old_amounts = shopping_cart.recipe_amounts(self.recipes[0].pk)
+        new_amounts = {
+            ingredient.pk: 5 * (index + 1)
+            for index, ingredient in enumerate(self.ingredients[2:])
+        }
+        RecipeIngredient.objects.filter(recipe=self.recipes[0]).delete()
+        for ingredient_id, amount in new_amounts.items():
+            RecipeIngredient.objects.create(
+                recipe=self.recipes[0], ingredient_id=ingredient_id,
+                amount=amount
+            )
+        # Одно UPDATE на все ингредиенты, сколько бы их ни менялось.
+        with self.assertNumQueries(8):
+            shopping_cart.change_recipe(
+                self.recipes[0].pk, old_amounts, new_amounts
+            )
+        self.assertTotalsConsistent()
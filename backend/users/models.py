@@ -2,11 +2,47 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 
 
-class User(AbstractUser):
+class CountersModel(models.Model):
+    """
+    Модель со счетчиками, которые меняются только UPDATE с F().
+
+    Обычное сохранение загруженного раньше экземпляра не записывает
+    поля из COUNTER_FIELDS и не затирает их устаревшими значениями.
+    """
+    COUNTER_FIELDS = ()
+
+    class Meta:
+        abstract = True
+
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        if not (self._state.adding or force_insert):
+            if update_fields is None:
+                deferred = self.get_deferred_fields()
+                update_fields = [
+                    field.name for field in self._meta.concrete_fields
+                    if not field.primary_key
+                    and field.attname not in deferred
+                    and field.name not in self.COUNTER_FIELDS
+                ]
+        super().save(force_insert=force_insert, force_update=force_update,
+                     using=using, update_fields=update_fields)
+
+
+class User(CountersModel, AbstractUser):
     """Модель пользователя"""
     email = models.EmailField('Электронная почта', max_length=254, unique=True)
+    recipes_count = models.PositiveIntegerField(
+        'Рецептов', default=0, editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        'Подписчиков', default=0, editable=False
+    )
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
+    COUNTER_FIELDS = ('recipes_count', 'followers_count')
+    # Поля, которые отдаются другим пользователям в рецептах и подписках.
+    PUBLIC_FIELDS = ('username', 'email', 'first_name', 'last_name')
 
     class Meta:
         constraints = [
@@ -22,6 +58,32 @@ class User(AbstractUser):
     def __str__(self):
         return self.username
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_public_fields()
+        return instance
+
+    def remember_public_fields(self):
+        self._public_values = {
+            name: self.__dict__[name]
+            for name in self.PUBLIC_FIELDS if name in self.__dict__
+        }
+
+    def public_fields_changed(self, update_fields=None):
+        """Изменились ли с загрузки поля из PUBLIC_FIELDS"""
+        if update_fields is not None and not (
+            set(update_fields) & set(self.PUBLIC_FIELDS)
+        ):
+            return False
+        loaded = getattr(self, '_public_values', None)
+        if loaded is None:
+            return True
+        return any(
+            name not in loaded or loaded[name] != self.__dict__[name]
+            for name in self.PUBLIC_FIELDS if name in self.__dict__
+        )
+
 
 class Subscribe(models.Model):
     """Модель подписки"""